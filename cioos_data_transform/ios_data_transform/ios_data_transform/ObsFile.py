@@ -3,12 +3,17 @@
     Changelog Version 0.1: July 15 2019 - convert python scripts and functions into a python class
     Author: Pramod Thupaki (pramod.thupaki@hakai.org)
 """
+import json
 import struct
-from datetime import datetime, timedelta
-import fortranformat as ff
+import mmap
+from time import perf_counter
 import numpy as np
-from pytz import timezone
-from .utils import find_geographic_area, read_geojson
+from .utils import load_geo_index
+from .fixed_width import read_fortran_columns, read_struct_columns, FormatNotSupported
+from .fixed_width import fortran_reader, struct_format_from_channel_detail, decode_lines
+from .fixed_width import channel_dtypes, to_typed, pad_value, mask_pad, table_spans, typed_table_column
+from .fixed_width import combine_date_time
+from .ios_dates import parse_date, ZONE_OFFSETS
 from shapely.geometry import Point
 from io import StringIO
 
@@ -22,10 +27,18 @@ class ObsFile(object):
     Incorporates functions from earlier versions of this toolbox
     """
 
-    def __init__(self, filename, debug):
+    # header structures set by import_data. saved in the header cache (see header_cache.py)
+    HEADER_ATTRIBUTES = ['type', 'start_dateobj', 'start_date', 'location', 'channels', 'comments', 'remarks',
+                         'administration', 'instrument', 'deployment', 'recovery', 'time_increment',
+                         'channel_details', 'file', 'ios_header_version', 'header_index', 'subsection_spans']
+
+    def __init__(self, filename, debug, lazy=False, cache=None):
         # initializes object by reading *FILE and ios_header_version
         # reads entire file to memory for all subsequent processing
         # inputs are filename and debug state
+        # lazy: file is memory-mapped and only the header is read into memory.
+        #       the data block is decoded when self.data is first used
+        # cache: HeaderCache. header parsed earlier is used if the file has not changed (see load_header)
         self.type = None
         self.debug = debug
         self.filename = filename
@@ -41,13 +54,38 @@ class ObsFile(object):
         self.data = None
         self.deployment = None
         self.recovery = None
+        self.time_increment = None
         self.obs_time = None
+        # pad value of each channel as float (see get_pad_values)
+        self.pad_values = None
+        self.header_index = None
+        self.subsection_spans = None
+        # typed header tables (see get_table)
+        self.tables = {}
+        # header serialized as json (see get_header_json)
+        self.header_json = {}
+        self.lazy = lazy
+        self.mmap = None
+        self.data_offset = None
+        self.data_pending = False
+        # method used to read the data block ('format', 'format_lines', 'fmt_struct', 'fmt_struct_lines' or
+        # 'genfromtxt'), time spent decoding data (seconds) and number of records read. used for instrumentation
+        self.read_method = None
+        self.read_time = 0.
+        self.records_read = 0
+        self.cache = cache
+        self.header_cached = False
         # try opening and reading the file. if error. soft-exit.
         try:
-            with open(self.filename, 'r', encoding='ASCII', errors='ignore') as fid:
-                self.lines = [l for l in fid.readlines()]
-            self.ios_header_version = self.get_header_version()
-            self.file = self.get_section('FILE')
+            if self.lazy:
+                self.lines = self.map_file()
+            else:
+                with open(self.filename, 'r', encoding='ASCII', errors='ignore') as fid:
+                    self.lines = [l for l in fid.readlines()]
+            if not self.load_header():
+                self.header_index, self.subsection_spans = self.index_header()
+                self.ios_header_version = self.get_header_version()
+                self.file = self.get_section('FILE')
             self.status = 1
         except Exception as e:
             print("Unable to open file", filename)
@@ -58,32 +96,327 @@ class ObsFile(object):
     def import_data(self):
         pass
 
+    def load_header(self):
+        # restore header structures (HEADER_ATTRIBUTES) from the header cache
+        # returns True if header was found in cache. import_data then only reads the data
+        if self.cache is None:
+            return False
+        header = self.cache.get(self.filename, type(self).__name__)
+        if header is None:
+            return False
+        for key in self.HEADER_ATTRIBUTES:
+            setattr(self, key, header[key])
+        self.header_cached = True
+        return True
+
+    def save_header(self):
+        # save header structures (HEADER_ATTRIBUTES) parsed by import_data to the header cache
+        if self.cache is None:
+            return
+        try:
+            self.cache.put(self.filename, type(self).__name__,
+                           {key: getattr(self, key) for key in self.HEADER_ATTRIBUTES})
+        except Exception as e:
+            print("Unable to save header to cache", self.filename, e)
+
+    @property
+    def data(self):
+        # data block is decoded on first use if import_data was called in lazy mode
+        if self.data_pending:
+            self.data_pending = False
+            self._data = self.read_data()
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self.data_pending = False
+        self._data = value
+        self._columns = None
+
+    def get_column(self, i):
+        # returns data of channel i as an array with the type of the channel (see get_typed_columns)
+        # numeric columns are contiguous float32 with pad values replaced by NaN
+        if self._columns is None:
+            self._columns = self.get_typed_columns()
+        return self._columns[i]
+
+    def get_typed_columns(self):
+        # returns list with an array for each channel. type of each channel is taken from CHANNEL DETAIL
+        # (datetime64 for dates, timedelta64 for times of day, int32 or float32 for numbers)
+        # data read using FORMAT (float) is masked (see mask_pad) and converted to column-major float32 once.
+        # columns are views. in lazy mode, data is decoded for the conversion but not kept in self.data
+        if self.data_pending:
+            data = self.read_data()
+        else:
+            data = self.data
+        data = self.mask_pad(data)
+        return [self.to_typed_column(data, i) for i in range(data.shape[1])]
+
+    def get_pad_values(self):
+        # returns array with pad value of each channel. Pad in CHANNEL DETAIL is used if available,
+        # otherwise PAD in FILE. channels without pad (e.g. ' ') are NaN
+        if self.pad_values is None:
+            nchan = int(self.file['NUMBER OF CHANNELS'])
+            if self.channel_details is not None:
+                pads = self.channel_details['Pad']
+            else:
+                pads = [self.file.get('PAD')] * nchan
+            self.pad_values = np.array([pad_value(p) for p in pads], dtype=float)
+        return self.pad_values
+
+    def mask_pad(self, data):
+        # replace pad values of all channels with NaN in data read from file (or a chunk of it)
+        # numeric data is returned as column-major float32 (see fixed_width.mask_pad)
+        # data read as strings is returned as is. pad values are masked when each column is converted
+        if data.dtype.kind not in 'fiu':
+            return data
+        return mask_pad(data, self.get_pad_values())
+
+    def to_typed_column(self, data, i):
+        # column i of data (or a chunk of data) converted to the type of channel i
+        # numeric data is expected to be masked already (see mask_pad) and is returned as is
+        # column is returned as strings if it can not be converted
+        if data.dtype.kind in 'fiu':
+            return data[:, i]
+        dtypes = self.channel_details['dtypes'] if self.channel_details is not None else []
+        try:
+            column = to_typed(data[:, i], dtypes[i] if i < len(dtypes) else np.float32)
+        except FormatNotSupported as e:
+            if self.debug:
+                print(e)
+            return data[:, i]
+        if column.dtype.kind == 'f':
+            column = mask_pad(column, self.get_pad_values()[i], column.dtype)
+        return column
+
+    def get_typed_data(self):
+        # returns dictionary of typed arrays (see get_column) with channel names as keys
+        # repeated channel names get a suffix, e.g. Oxygen:Dissolved:SBE and Oxygen:Dissolved:SBE_2
+        info = {}
+        for i, name in enumerate(self.channels['Name']):
+            key, n = name.strip(), 2
+            while key in info:
+                key, n = '{}_{}'.format(name.strip(), n), n + 1
+            info[key] = self.get_column(i)
+        return info
+
+    def get_time_channels(self):
+        # returns index of date and time of day channels as (date, time) or None if there is no date channel
+        # time is None for date and time channels (DT). types are taken from CHANNEL DETAIL (see channel_dtypes)
+        if self.channel_details is None:
+            return None
+        dtypes = self.channel_details['dtypes']
+        dates = [i for i, t in enumerate(dtypes) if t.startswith('datetime64')]
+        times = [i for i, t in enumerate(dtypes) if t.startswith('timedelta64')]
+        if len(dates) == 0:
+            return None
+        if dtypes[dates[0]] != 'datetime64[D]' or len(times) == 0:
+            return dates[0], None
+        return dates[0], times[0]
+
+    def get_record_time(self, block=None, start=0):
+        # returns time of each record (UTC) read from the date and time channels of data (or a chunk of it)
+        # all records are converted at once (datetime64[ms]). times are in the time zone of START TIME
+        # records with missing date or time, or files without date channels, use get_default_time
+        # block: data read from file (see iter_data) and start: index of its first record. default is all data
+        if block is None:
+            nrec = int(self.file['NUMBER OF RECORDS'])
+            column = self.get_column
+        else:
+            nrec = len(block)
+            column = lambda i: self.to_typed_column(block, i)
+        channels = self.get_time_channels()
+        if channels is None:
+            return self.get_default_time(nrec, start)
+        date, time = channels
+        # columns that could not be converted are strings (see to_typed_column)
+        columns = [column(i) for i in channels if i is not None]
+        if any([c.dtype.kind not in 'Mm' for c in columns]):
+            return self.get_default_time(nrec, start)
+        zone = self.file['START TIME'].strip().upper()[0:3]
+        record_time = combine_date_time(*columns) + np.timedelta64(ZONE_OFFSETS[zone], 'h')
+        missing = np.isnat(record_time)
+        if missing.any():
+            record_time[missing] = self.get_default_time(nrec, start)[missing].astype('datetime64[ms]')
+        return record_time
+
+    def get_default_time(self, nrec, start=0):
+        # time of records without date and time channels. computed from start time and time increment
+        # all records have the start time if there is no time increment (e.g. CTD profiles and bottle files)
+        if self.time_increment is None:
+            return np.full(nrec, np.datetime64(self.start_dateobj.replace(tzinfo=None), 'ms'))
+        return self.get_time_axis(self.time_increment, nrec=nrec, start=start)
+
+    @property
+    def obs_time(self):
+        # time of each record is computed on first use if only the time increment was set by import_data
+        if self._obs_time is None and self.time_increment is not None:
+            self._obs_time = self.get_time_axis(self.time_increment)
+        return self._obs_time
+
+    @obs_time.setter
+    def obs_time(self, value):
+        self._obs_time = value
+
+    def map_file(self):
+        # memory-map the file and return lines in the header (up to and including *END OF HEADER)
+        # byte offset of the data block is stored in self.data_offset
+        with open(self.filename, 'rb') as fid:
+            self.mmap = mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ)
+        idx = self.mmap.find(b'\n*END OF HEADER')
+        if idx == -1:
+            # no data block. read entire file as header
+            self.data_offset = len(self.mmap)
+        else:
+            end = self.mmap.find(b'\n', idx + 1)
+            self.data_offset = len(self.mmap) if end == -1 else end + 1
+        return decode_lines(self.mmap[:self.data_offset])
+
+    def get_data_lines(self):
+        # returns lines in the data block (after *END OF HEADER)
+        if self.lazy:
+            return decode_lines(self.mmap[self.data_offset:])
+        idx = self.find_index('*END OF HEADER')
+        return self.lines[idx + 1:]
+
+    def get_data_block(self):
+        # returns data block used by the column readers in fixed_width
+        # lazy mode: bytes after *END OF HEADER as uint8 array backed by the memory-mapped file (no copy)
+        # otherwise: lines after *END OF HEADER
+        if self.lazy:
+            return np.frombuffer(self.mmap, dtype=np.uint8, offset=self.data_offset)
+        return self.get_data_lines()
+
+    def get_data_chunks(self, chunk_size):
+        # yields data block in pieces of about chunk_size lines (same type as get_data_block)
+        # lazy mode: pieces are views of the memory-mapped file that end at a line boundary
+        if not self.lazy:
+            lines = self.get_data_lines()
+            for i in range(0, len(lines), chunk_size):
+                yield lines[i:i + chunk_size]
+            return
+        block = np.frombuffer(self.mmap, dtype=np.uint8, offset=self.data_offset)
+        eol = self.mmap.find(b'\n', self.data_offset)
+        line_length = len(block) if eol == -1 else eol - self.data_offset + 1
+        start = 0
+        while start < len(block):
+            end = start + line_length * chunk_size
+            if end < len(block):
+                eol = self.mmap.find(b'\n', self.data_offset + end - 1)
+                end = len(block) if eol == -1 else eol - self.data_offset + 1
+            yield block[start:end]
+            start = end
+
+    def block_lines(self, block):
+        # lines in data block returned by get_data_block or get_data_chunks
+        if isinstance(block, np.ndarray):
+            return decode_lines(block.tobytes())
+        return block
+
+    def close(self):
+        # release memory-mapped file (lazy mode)
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+
     def get_header_version(self):
         # reads header version
         return self.lines[self.find_index('*IOS HEADER VERSION')][20:24]
 
+    def index_header(self):
+        # single pass through the header (up to *END OF HEADER) to find all sections and subsections
+        # returns two dicts:
+        #   sections: name of section (line starting with '*') -> line span (start, end)
+        #   subsections: line number where subsection ($TABLE, $REMARKS etc.) starts -> line number of its $END
+        # section span ends at the next line that starts with '*' or '$' (same rule used by get_section)
+        sections = {}
+        subsections = {}
+        section = None
+        sub_start = None
+        for i, l in enumerate(self.lines):
+            if sub_start is not None:
+                # inside subsection. only $END closes it
+                if l.strip()[0:4] == '$END':
+                    subsections[sub_start] = i
+                    sub_start = None
+                continue
+            if len(l.strip()) == 0 or l[0] == '!':
+                continue
+            elif l[0] in ['$', '*']:
+                if section is not None:
+                    sections[section] = (sections[section][0], i)
+                    section = None
+                name = l.strip()
+                if l[0] == '*' and name not in sections:
+                    sections[name] = (i, len(self.lines))
+                    section = name
+                if name[0:len('*END OF HEADER')] == '*END OF HEADER':
+                    break
+            elif '$' in l[1:5] and section is not None:
+                sub_start = i
+        if self.debug:
+            print("Sections found in header:", list(sections.keys()))
+        return sections, subsections
+
     def find_index(self, string):
         # finds line number that starts with string
         # input: string (nominally the section)
-        for i, l in enumerate(self.lines):
+        # sections are looked up in the header index. other strings are searched for in the header only
+        if self.header_index is not None:
+            if string in self.header_index:
+                return self.header_index[string][0]
+            for name, span in self.header_index.items():
+                if name[0:len(string)] == string:
+                    return span[0]
+            end = self.header_index.get('*END OF HEADER', (len(self.lines),))[0]
+        else:
+            end = len(self.lines)
+        for i, l in enumerate(self.lines[:end]):
             if l.lstrip()[0:len(string)] == string:
                 return i
         if self.debug:
             print("Index not found", string)
         return -1
 
-    def get_complete_header(self):
+    def find_span(self, section_name):
+        # returns line span (start, end) of section in the header
+        # end is the line number where the next section starts
+        if section_name in self.header_index:
+            return self.header_index[section_name]
+        idx = self.find_index(section_name)
+        if idx == -1:
+            return None
+        for span in self.header_index.values():
+            if span[0] == idx:
+                return span
+        return idx, len(self.lines)
+
+    def get_complete_header(self, compact=False):
         # return all sections in header as a dict
+        # compact: sections like COMMENTS are lists of lines instead of dictionaries with line numbers as keys
         sections = self.get_list_of_sections()
         header = {}
         for sec in sections:
             # print ("getting section:", sec)
             if sec in ['COMMENTS', 'REMARKS', 'HISTORY']:
                 header[sec] = self.get_comments_like(sec)
+                if compact:
+                    header[sec] = list(header[sec].values()) if isinstance(header[sec], dict) else []
             else:
                 header[sec] = self.get_section(sec)
         return header
 
+    def get_header_json(self, compact=False):
+        # return complete header (see get_complete_header) as json string. header is serialized once per file
+        # compact: sections like COMMENTS are lists of lines and json is written without white space
+        if compact not in self.header_json:
+            if compact:
+                self.header_json[compact] = json.dumps(self.get_complete_header(compact=True), ensure_ascii=False,
+                                                       separators=(',', ':'))
+            else:
+                self.header_json[compact] = json.dumps(self.get_complete_header(), ensure_ascii=False, indent=False)
+        return self.header_json[compact]
+
     def get_section(self, section_name):
         # deciphers the information in a particular section
         # reads table information
@@ -91,13 +424,13 @@ class ObsFile(object):
         # records (subsections) are returned as list of lines for subsequent processing
         if section_name[0] != '*':
             section_name = '*' + section_name
-        idx = self.find_index(section_name)
-        if idx == -1:
+        span = self.find_span(section_name)
+        if span is None:
             print('Section not found' + section_name + self.filename)
             return {}
+        idx, end = span
         info = {}
-        # EOS = False # end of section logical
-        while True:
+        while idx + 1 < end:
             idx += 1
             l = self.lines[idx]
             if len(l.strip()) == 0:  # skip line if blank
@@ -109,18 +442,13 @@ class ObsFile(object):
             elif '$' in l[1:5]:
                 # read record or 'sub-section'. This nominally starts with tab of 4 spaces
                 # but can be 1 or 2 spaces as well for REMARKS
-                EOR = False
+                # lines that make up the record are found using the span recorded in header index
                 record_name = l.strip()
                 if self.debug:
                     print("Found subsection:{} in section:{}".format(record_name, section_name))
-                info[record_name] = []
-                while not EOR:
-                    idx += 1
-                    l = self.lines[idx]
-                    if l.strip()[0:4] == '$END':
-                        EOR = True
-                    else:
-                        info[record_name].append(l)
+                record_end = self.subsection_spans.get(idx, end)
+                info[record_name] = self.lines[idx + 1:record_end]
+                idx = record_end
             else:
                 if self.debug:
                     print(l)
@@ -138,14 +466,63 @@ class ObsFile(object):
             if self.debug:
                 print("Finding subsection", name)
             name = '$' + name
-        if name not in self.file.keys():
+        if name not in section.keys():
             print("Did not find subsection:{} in {}".format(name, self.filename))
-        elif name == '$TABLE: CHANNELS':
-            info = self.file[name]
-        elif name == '$TABLE: CHANNEL DETAIL':
-            info = self.file[name]
+        else:
+            info = section[name]
         return info
 
+    def split_table(self, lines):
+        # split lines of a $TABLE subsection into columns
+        # column spans are taken from the dash line ('!---  -----') once and every row is sliced by these spans
+        # returns names of the columns (from the line above the dash line) and list of columns (list of strings)
+        # values are not stripped. rows that are blank or comments are skipped
+        mask_idx = None
+        for i, l in enumerate(lines):
+            buf = l.strip()
+            if len(buf) > 1 and buf[0] == '!' and buf[1:].replace('-', '').strip() == '' and '-' in buf:
+                mask_idx = i
+                break
+        if mask_idx is None:
+            raise Exception('Column mask not found in table', self.filename)
+        spans = table_spans(lines[mask_idx])
+        header = lines[mask_idx - 1] if mask_idx > 0 else ''
+        names = []
+        for j, name in enumerate(self.apply_col_mask(header, lines[mask_idx])):
+            name = name.strip().lstrip('!').strip() or 'Column{}'.format(j + 1)
+            while name in names:
+                name = name + '_'
+            names.append(name)
+        rows = [self.apply_col_mask(l, lines[mask_idx]) for l in lines[mask_idx + 1:]
+                if len(l.strip()) > 0 and l.strip()[0] != '!']
+        return names, [[row[j] for row in rows] for j in range(len(spans))]
+
+    def get_table(self, section, name):
+        # returns $TABLE subsection name (e.g. 'SENSORS') of section (e.g. 'INSTRUMENT') as dictionary with
+        # a numpy array for each column (see fixed_width.typed_table_column)
+        # e.g. get_table('HISTORY', 'PROGRAMS')['Date'] is datetime64. returns None if table is not in file
+        # tables are parsed once and kept in self.tables
+        section = section.lstrip('*').strip()
+        name = name.lstrip('$').strip()
+        if not name.startswith('TABLE:'):
+            name = 'TABLE: ' + name
+        if (section, name) not in self.tables:
+            lines = self.get_section(section).get('$' + name)
+            if lines is None:
+                if self.debug:
+                    print("Did not find table:{} in {}".format(name, section))
+                return None
+            names, columns = self.split_table(lines)
+            self.tables[(section, name)] = {key: typed_table_column(column, key)
+                                          for key, column in zip(names, columns)}
+        return self.tables[(section, name)]
+
+    def parse_table(self, lines):
+        # returns $TABLE subsection (e.g. CHANNELS, CHANNEL DETAIL, SENSORS, PROGRAMS) as dictionary with
+        # a list of (stripped) values for each column. keys are the column names in the table
+        names, columns = self.split_table(lines)
+        return {name: [v.strip() for v in column] for name, column in zip(names, columns)}
+
     def get_dt(self):
         # converts time increment from ios format to seconds
         # float32 accurate (seconds are not rounded to integers)
@@ -158,6 +535,16 @@ class ObsFile(object):
             dt = None
         return dt
 
+    def get_time_axis(self, time_increment, nrec=None, start=0):
+        # returns time of each record as datetime64 array (UTC, microsecond precision)
+        # computed from start time and time increment (seconds) without creating datetime objects
+        # nrec: number of records (default is 'NUMBER OF RECORDS'). start: index of first record
+        if nrec is None:
+            nrec = int(self.file['NUMBER OF RECORDS'])
+        t0 = np.datetime64(self.start_dateobj.replace(tzinfo=None), 'us')
+        offsets = np.round(time_increment * np.arange(start, start + nrec) * 1e6).astype('timedelta64[us]')
+        return t0 + offsets
+
     def get_date(self, opt='start'):
         # reads datetime string in "START TIME" and converts to datetime object
         # return datetime object and as standard string format
@@ -173,38 +560,10 @@ class ObsFile(object):
             raise Exception("Invalid option for get_date function !")
         if self.debug:
             print("Raw date string:", date_string)
-        # get the naive (timezone unaware) datetime obj
-        try:
-            date_obj = datetime.strptime(date_string[4:], '%Y/%m/%d %H:%M:%S.%f')
-        except Exception as e:
-            print(e)
-            date_obj = datetime.strptime(date_string[4:], '%Y/%m/%d')
-            print(date_obj)
-        # make datetime object, aware of its timezone
-        # for GMT, UTC
-        if any([date_string.find(z) == 0 for z in ['GMT', 'UTC']]):
-            date_obj = timezone(date_string[0:3]).localize(date_obj)
-        # for PST/PDT
-        elif 'PST' in date_string.upper():
-            date_obj = timezone('UTC').localize(date_obj + timedelta(hours=8))
-        elif 'PDT' in date_string.upper():
-            date_obj = timezone('UTC').localize(date_obj + timedelta(hours=7))
-        # Canada/Mountain
-        elif 'MST' in date_string.upper():
-            date_obj = timezone('UTC').localize(date_obj + timedelta(hours=7))
-        elif 'MDT' in date_string.upper():
-            date_obj = timezone('UTC').localize(date_obj + timedelta(hours=6))
-        # Canada/Atlantic
-        elif 'AST' in date_string.upper():
-            date_obj = timezone('UTC').localize(date_obj + timedelta(hours=4))
-        elif 'ADT' in date_string.upper():
-            date_obj = timezone('UTC').localize(date_obj + timedelta(hours=3))
-        else:
-            raise Exception("Problem finding the timezone information->", self.filename)
+        # datetime object (UTC) from date string and time zone offset (see ios_dates.py)
+        date_obj, _ = parse_date(date_string)
         if self.debug:
             print('Date obj with timezone info:', date_obj)
-        # convert all datetime to utc before writing to netcdf file
-        date_obj = date_obj.astimezone(timezone('UTC'))
         return date_obj, date_obj.strftime('%Y/%m/%d %H:%M:%S.%f %Z')
 
     def fmt_len(self, fmt):
@@ -212,12 +571,17 @@ class ObsFile(object):
         # assumes on 's' data fromat
         return np.asarray(fmt[0:-1].split('s'), dtype='int').sum()
 
-    def get_data(self, formatline=None):
+    def get_data(self, formatline=None, block=None):
         # reads data using the information in FORMAT
         # if FORMAT information in file header is missing or does not work
         # then create 'struct' data format based on channel details information
-        idx = self.find_index('*END OF HEADER')
-        lines = self.lines[idx + 1:]
+        # data block is decoded column-wise using numpy (see fixed_width.py)
+        # line by line readers are used if the data cannot be decoded that way
+        # block: part of the data block to read (see get_data_chunks). default is the entire data block
+        # method used to read the data is stored in self.read_method
+        start = perf_counter()
+        if block is None:
+            block = self.get_data_block()
         data = []
         # if formatline is None, try reading without any format (assume columns are space limited;
         #       if space limited strategy does not work, try to create format line)
@@ -225,32 +589,109 @@ class ObsFile(object):
             try:
                 print("Trying to read file using format created using column width")
                 print("Reading data using format", self.channel_details['fmt_struct'])
-                fmt_len = self.fmt_len(self.channel_details['fmt_struct'])
                 fmt_struct = self.channel_details['fmt_struct']
-                for i in range(len(lines)):
-                    if len(lines[i].strip()) > 1:
-                        # py2-3 migration...
-                        # data.append(struct.unpack(self.channel_details['fmt_struct'], lines[i].rstrip().ljust(fmt_len)))
-                        data.append(struct.unpack(fmt_struct, lines[i].rstrip().ljust(fmt_len).encode('utf-8')))
-                        # data.append([r for r in lines[i].split()])
+                try:
+                    data = read_struct_columns(block, fmt_struct)
+                    self.read_method = 'fmt_struct'
+                except FormatNotSupported as e:
+                    if self.debug:
+                        print(e)
+                    self.read_method = 'fmt_struct_lines'
+                    data = []
+                    lines = self.block_lines(block)
+                    fmt_len = self.fmt_len(fmt_struct)
+                    for i in range(len(lines)):
+                        if len(lines[i].strip()) > 1:
+                            # py2-3 migration...
+                            # data.append(struct.unpack(self.channel_details['fmt_struct'], lines[i].rstrip().ljust(fmt_len)))
+                            data.append(struct.unpack(fmt_struct, lines[i].rstrip().ljust(fmt_len).encode('utf-8')))
+                            # data.append([r for r in lines[i].split()])
             except Exception as e:
                 print(e)
-                data = np.genfromtxt(StringIO(''.join(lines)), delimiter='', dtype=str, comments=None)
+                data = np.genfromtxt(StringIO(''.join(self.block_lines(block))), delimiter='', dtype=str,
+                                     comments=None)
+                self.read_method = 'genfromtxt'
                 print("Reading data using delimiter was successful !")
 
         else:
-            ffline = ff.FortranRecordReader(formatline)
-            for i in range(len(lines)):
-                if len(lines[i]) > 0:
-                    data.append([float(r) for r in ffline.read(lines[i])])
+            try:
+                data = read_fortran_columns(block, formatline)
+                self.read_method = 'format'
+            except FormatNotSupported as e:
+                if self.debug:
+                    print(e)
+                self.read_method = 'format_lines'
+                data = []
+                lines = self.block_lines(block)
+                ffline = fortran_reader(formatline)
+                for i in range(len(lines)):
+                    if len(lines[i]) > 0:
+                        data.append([float(r) for r in ffline.read(lines[i])])
         data = np.asarray(data)
         if self.debug:
             print(data)
         # if data is at only one, convert list to 2D matrix
         if len(data.shape) == 1:
             data = data.reshape((1, -1))
+        self.read_time = self.read_time + perf_counter() - start
+        self.records_read = self.records_read + len(data)
         return data
 
+    def read_data(self):
+        # try reading file using format specified in 'FORMAT'
+        # if that does not work, use the format created from channel details
+        # returns None if data could not be read
+        try:
+            return self.get_data(formatline=self.file['FORMAT'])
+        except Exception as e:
+            print("Could not read file using 'FORMAT' description ...", self.filename)
+        try:
+            return self.get_data(formatline=None)
+        except Exception as e:
+            return None
+
+    def iter_data(self, chunk_size=100000, masked=False):
+        # reads data block in chunks of about chunk_size records. memory used does not depend on file length
+        # yields index of first record in chunk and data (same as read_data) for each chunk
+        # masked: pad values of numeric data are replaced with NaN in each chunk (see mask_pad)
+        # format that worked for the first chunk is used for the rest of the file
+        # data that was already read (e.g. by import_data when not in lazy mode) is not decoded again.
+        # chunks are slices of self.data
+        if not self.data_pending and self._data is not None:
+            for start in range(0, len(self._data), chunk_size):
+                data = self._data[start:start + chunk_size]
+                yield start, self.mask_pad(data) if masked else data
+            return
+        formatline = self.file['FORMAT'] if 'FORMAT' in self.file else None
+        start = 0
+        for block in self.get_data_chunks(chunk_size):
+            data = None
+            if formatline is not None:
+                try:
+                    data = self.get_data(formatline=formatline, block=block)
+                except Exception as e:
+                    if start > 0:
+                        raise
+                    print("Could not read file using 'FORMAT' description ...", self.filename)
+                    formatline = None
+            if data is None:
+                data = self.get_data(formatline=None, block=block)
+            if data.size == 0:
+                continue
+            yield start, self.mask_pad(data) if masked else data
+            start = start + len(data)
+
+    def load_data(self):
+        # read data block after header has been imported
+        # in lazy mode, data is read when self.data is first used
+        if self.lazy:
+            self.data_pending = True
+            return 1
+        self.data = self.read_data()
+        if self.data is None:
+            return 0
+        return 1
+
     def get_location(self):
         # read 'LOCATION' section from ios header
         # convert lat and lon to standard format (float, -180 to +180)
@@ -288,30 +729,19 @@ class ObsFile(object):
         lines = self.get_subsection('TABLE: CHANNEL DETAIL', self.file)
         if lines is None:
             return None
-        mask = lines[1].rstrip()
         info = {}
-        ch_det = [self.apply_col_mask(l, mask) for l in lines[2:]]
-        info['Pad'] = [l[1] for l in ch_det]
-        info['Width'] = [l[3] for l in ch_det]
-        info['Format'] = [l[4] for l in ch_det]
-        info['Type'] = [l[5] for l in ch_det]
+        _, columns = self.split_table(lines)
+        info['Pad'] = columns[1]
+        info['Width'] = columns[3]
+        info['Format'] = columns[4]
+        info['Type'] = columns[5]
         if int(self.file['NUMBER OF CHANNELS']) != len(info['Pad']):
             raise Exception('Number of channels in file record does not match channel_details!')
         else:
-            fmt = ''
-            for i in range(len(info['Pad'])):
-                if info['Type'][i].strip() == 'D':
-                    fmt = fmt + '11s'
-                elif info['Type'][i].strip() == 'DT':
-                    fmt = fmt + '17s'
-                elif info['Format'][i].strip().upper() == 'HH:MM:SS':
-                    fmt = fmt + '9s'
-                elif info['Format'][i].strip().upper() == 'HH:MM':
-                    fmt = fmt + '6s'
-                else:
-                    fmt = fmt + info['Width'][i].strip() + 's'
-
+            fmt = struct_format_from_channel_detail(tuple(info['Type']), tuple(info['Format']),
+                                                    tuple(info['Width']))
             info['fmt_struct'] = fmt
+            info['dtypes'] = channel_dtypes(tuple(info['Type']), tuple(info['Format']))
         if self.debug:
             print("Python compatible data format:", fmt)
         return info
@@ -320,31 +750,26 @@ class ObsFile(object):
         # get the details of al the channels in the file
         # return as dictionary with each column as list
         lines = self.get_subsection('TABLE: CHANNELS', self.file)
-        mask = lines[1].rstrip()
         info = {}
-        ch = [self.apply_col_mask(l, mask) for l in lines[2:]]
-        info['Name'] = [l[1] for l in ch]
-        info['Units'] = [l[2] for l in ch]
-        info['Minimum'] = [l[3] for l in ch]
-        info['Maximum'] = [l[4] for l in ch]
+        _, columns = self.split_table(lines)
+        info['Name'] = columns[1]
+        info['Units'] = columns[2]
+        info['Minimum'] = columns[3]
+        info['Maximum'] = columns[4]
         return info
 
     def apply_col_mask(self, data, mask):
         # apply mask to string (data) to get columns
         # return list of columns
+        # columns are the characters of data under each group of '-' in mask (see fixed_width.table_spans)
+        # text beyond the end of mask is kept in the last column
         if self.debug:
             print(data, mask)
-        data = data.rstrip().ljust(len(mask))
-        a = [d == '-' for d in mask]
-        ret = []
-        for i in range(len(data)):
-            if not a[i]:
-                ret.append('*')
-            else:
-                ret.append(data[i])
-        buf = ''.join(ret).split('*')
-        while ("" in buf):
-            buf.remove("")
+        spans = table_spans(mask.rstrip())
+        data = data.rstrip().ljust(len(mask.rstrip()))
+        buf = [data[start:end] for start, end in spans]
+        if len(buf) > 0 and len(data) > spans[-1][1]:
+            buf[-1] = data[spans[-1][0]:]
         return buf
 
     def get_comments_like(self, section_name):
@@ -379,20 +804,21 @@ class ObsFile(object):
         # parse the entire header and returns list of sections available
         # skip first 2 lines of file (that has date and ios_header_version)
         # skip * in beginning of section name
+        # sections are read from the header index
         sections_list = []
-        for i, line in enumerate(self.lines[2:]):
-            if line[0] == '*' and line[0:4] != '*END' and line[1] not in ['*', ' ', '\n']:
-                sections_list.append(line.strip()[1:])
-            else:
+        for name, span in self.header_index.items():
+            line = self.lines[span[0]]
+            if span[0] < 2:
                 continue
+            elif line[0:4] != '*END' and line[1] not in ['*', ' ', '\n']:
+                sections_list.append(line.strip()[1:])
         if self.debug:
             print(sections_list)
         return sections_list
 
     def assign_geo_code(self, geojson_file):
-        # read geojson file
-        polygons_dict = read_geojson(geojson_file)
-        geo_code = find_geographic_area(polygons_dict, Point(self.location['LONGITUDE'], self.location['LATITUDE']))
+        # polygons in geojson file are read and indexed once per process
+        geo_code = load_geo_index(geojson_file).find(Point(self.location['LONGITUDE'], self.location['LATITUDE']))
         if geo_code == '':
             # geo_code = self.LOCATION['GEOGRAPHIC AREA'].strip()
             geo_code = 'None'
@@ -408,6 +834,8 @@ class CtdFile(ObsFile):
     """
 
     def import_data(self):
+        if self.header_cached:
+            return self.load_data()
         self.type = 'ctd'
         self.start_dateobj, self.start_date = self.get_date(opt='start')
         self.location = self.get_location()
@@ -419,21 +847,10 @@ class CtdFile(ObsFile):
         self.channel_details = self.get_channel_detail()
         if self.channel_details is None:
             print("Unable to get channel details from header...")
+        self.save_header()
 
-        # try reading file using format specified in 'FORMAT'
-        try:
-            self.data = self.get_data(formatline=self.file['FORMAT'])
-        except Exception as e:
-            self.data = None
-            print("Could not read file using 'FORMAT' description ...", self.filename)
-        if self.data is None:
-            try:
-                # self.channel_details = self.get_channel_detail()
-                self.data = self.get_data(formatline=None)
-            except Exception as e:
-                return 0
-
-        return 1
+        # try reading file using format specified in 'FORMAT'. use channel details if that fails
+        return self.load_data()
 
 
 class CurFile(ObsFile):
@@ -441,6 +858,8 @@ class CurFile(ObsFile):
     Read current meter file in IOS format
     """
     def import_data(self):
+        if self.header_cached:
+            return self.load_data()
         self.type = 'cur'
         self.start_dateobj, self.start_date = self.get_date(opt='start')
         self.location = self.get_location()
@@ -451,27 +870,15 @@ class CurFile(ObsFile):
         self.instrument = self.get_section('INSTRUMENT')
         self.deployment = self.get_section('DEPLOYMENT')
         self.recovery = self.get_section('RECOVERY')
-        time_increment = self.get_dt()
-        self.obs_time = [self.start_dateobj + timedelta(seconds=time_increment * (i))
-                         for i in range(int(self.file['NUMBER OF RECORDS']))]
+        # time of each record (obs_time) is computed from start time and time increment when used
+        self.time_increment = self.get_dt()
 
         self.channel_details = self.get_channel_detail()
         if self.channel_details is None:
             print("Unable to get channel details from header...")
-        # try reading file using format specified in 'FORMAT'
-        try:
-            self.data = self.get_data(formatline=self.file['FORMAT'])
-        except Exception as e:
-            print("Could not read file using 'FORMAT' description...")
-            self.data = None
-
-        if self.data is None:
-            try:
-                # self.channel_details = self.get_channel_detail()
-                self.data = self.get_data(formatline=None)
-            except Exception as e:
-                return 0
-        return 1
+        self.save_header()
+        # try reading file using format specified in 'FORMAT'. use channel details if that fails
+        return self.load_data()
 
 
 class MCtdFile(ObsFile):
@@ -482,7 +889,8 @@ class MCtdFile(ObsFile):
     Author: Pramod Thupaki pramod.thupaki@hakai.org
     """
     def import_data(self):
-        from datetime import timedelta
+        if self.header_cached:
+            return self.load_data()
         self.type = 'mctd'
         self.start_dateobj, self.start_date = self.get_date(opt='start')
         self.location = self.get_location()
@@ -504,24 +912,13 @@ class MCtdFile(ObsFile):
             time_increment = (enddateobj - self.start_dateobj).total_seconds()/(int(self.file['NUMBER OF RECORDS'])-1)
             print('New time increment =', time_increment)
 
-        self.obs_time = [self.start_dateobj + timedelta(seconds=time_increment * (i))
-                         for i in range(int(self.file['NUMBER OF RECORDS']))]
+        # time of each record (obs_time) is computed from start time and time increment when used
+        self.time_increment = time_increment
         if self.debug:
             print(self.obs_time[0], self.obs_time[-1])
-        # try reading file using format specified in 'FORMAT'
-        try:
-            self.data = self.get_data(formatline=self.file['FORMAT'])
-        except Exception as e:
-            print("Could not read file using 'FORMAT' description...")
-            self.data = None
-
-        if self.data is None:
-            try:
-                # self.channel_details = self.get_channel_detail()
-                self.data = self.get_data(formatline=None)
-            except Exception as e:
-                return 0
-        return 1
+        self.save_header()
+        # try reading file using format specified in 'FORMAT'. use channel details if that fails
+        return self.load_data()
 
 
 class BotFile(ObsFile):
@@ -529,6 +926,8 @@ class BotFile(ObsFile):
     Read bottle files in IOS format
     """
     def import_data(self):
+        if self.header_cached:
+            return self.load_data()
         self.type = 'bot'
         self.start_dateobj, self.start_date = self.get_date(opt='start')
         self.location = self.get_location()
@@ -540,18 +939,6 @@ class BotFile(ObsFile):
         self.channel_details = self.get_channel_detail()
         if self.channel_details is None:
             print("Unable to get channel details from header...")
-        # try reading file using format specified in 'FORMAT'
-        try:
-            self.data = self.get_data(formatline=self.file['FORMAT'])
-        except Exception as e:
-            print("Could not read file using 'FORMAT' description...")
-            self.data = None
-
-        if self.data is None:
-            try:
-                # self.channel_details = self.get_channel_detail()
-                self.data = self.get_data(formatline=None)
-            except Exception as e:
-                return 0
-
-        return 1
+        self.save_header()
+        # try reading file using format specified in 'FORMAT'. use channel details if that fails
+        return self.load_data()
@@ -5,9 +5,32 @@
 # AIM:  this will be the common entry point for data from different sources that go into CIOOS
 #       ensuring common ncfile metadata standards. File has to conform to CF conventions and CIOOS variable standards
 from netCDF4 import Dataset as ncdata
+import numpy as np
+
+# netcdf write profiles. selected using the profile attribute of the file class (or <ftype>_nc_profile in .env)
+# fast: no compression (quickest to write). balanced: moderate deflate. archive: maximum deflate and larger chunks
+# chunk shapes depend on the record dimension and are set in CHUNK_SIZES of each file class
+WRITE_PROFILES = {
+    'fast': {'zlib': False, 'complevel': 0, 'shuffle': False},
+    'balanced': {'zlib': True, 'complevel': 4, 'shuffle': True},
+    'archive': {'zlib': True, 'complevel': 9, 'shuffle': True}
+}
+# encoding of the original IOS header (json, see ObsFile.get_header_json) selected using the header_format
+# attribute of the file class (header_format argument of the writers, or header_format in .env)
+# attribute: global attribute HEADER (default)
+# compact: global attribute HEADER. sections like COMMENTS are lists of lines (no line numbers) and json has no
+#          white space
+# variable: compact header in variable HEADER (characters compressed with deflate) instead of a global attribute
+# aggregated files (CtdRaggedNcFile) write the header of each profile in variable header (full or compact json)
+HEADER_FORMATS = ['attribute', 'compact', 'variable']
 
 
 class OceanNcFile(object):
+    # chunk length along the record dimension for each write profile. set by the file classes
+    CHUNK_SIZES = {}
+    # attributes of OceanNcVar written to each netcdf variable (if not None)
+    VARIABLE_ATTRIBUTES = ['long_name', 'standard_name', 'units']
+
     def __init__(self):
         self.featureType = ''
         self.summary = ''
@@ -16,9 +39,15 @@ class OceanNcFile(object):
         self.history = ''
         self.infoUrl = ''
         self.HEADER = ''
+        # encoding of HEADER (see HEADER_FORMATS)
+        self.header_format = 'attribute'
         # list of var class in the netcdf
         self.varlist = []
         self.nrec = 0
+        # netcdf write profile (see WRITE_PROFILES)
+        self.profile = 'fast'
+        # iterator of (index of first record, data) for variables written in chunks (see write_chunks)
+        self.chunks = None
 
     def write_ncfile(self, ncfilename):
         # create ncfile
@@ -30,7 +59,7 @@ class OceanNcFile(object):
         setattr(self.ncfile, 'institution', self.institution)
         setattr(self.ncfile, 'history', self.history)
         setattr(self.ncfile, 'infoUrl', self.infoUrl)
-        setattr(self.ncfile, 'HEADER', self.HEADER)
+        self.write_header()
         # setup dimensions
         self.setup_dimensions()
         # setup attributes unique to the datatype
@@ -38,34 +67,97 @@ class OceanNcFile(object):
         # write variables
         for var in self.varlist:
             self.__write_var(var)
+        if self.chunks is not None:
+            self.write_chunks()
         self.ncfile.close()
 
+    def write_header(self):
+        # write original header (json) as global attribute or variable (see HEADER_FORMATS)
+        if self.header_format not in HEADER_FORMATS:
+            raise Exception('header format not understood: {}'.format(self.header_format))
+        if self.header_format != 'variable':
+            setattr(self.ncfile, 'HEADER', self.HEADER)
+            return
+        buf = np.frombuffer(self.HEADER.encode('utf-8'), dtype='S1')
+        if len(buf) == 0:
+            return
+        self.ncfile.createDimension('header_length', len(buf))
+        ncvar = self.ncfile.createVariable('HEADER', 'S1', ('header_length',), zlib=True, complevel=9)
+        ncvar.long_name = 'Original IOS header'
+        ncvar.comment = 'json dictionary of header sections. COMMENTS, REMARKS and HISTORY are lists of lines'
+        ncvar._Encoding = 'utf-8'
+        ncvar[:] = buf
+
+    def write_chunks(self):
+        # write variables that have a data source (var.source) one chunk of records at a time
+        # only one chunk of data is held in memory. records are appended along the record dimension
+        streamed = [var for var in self.varlist if var.source is not None]
+        for start, block in self.chunks:
+            for var in streamed:
+                self.ncfile[var.name][start:start + len(block)] = var.get_chunk(start, block)
+
     def setup_dimensions(self):
         pass
 
     def setup_filetype(self):
         setattr(self.ncfile, 'cdm_profile_variables', '')
 
+    def get_write_options(self, var):
+        # returns compression and chunking options passed to createVariable for var
+        # scalar and string variables are always written without compression
+        if self.profile not in WRITE_PROFILES:
+            raise Exception('netcdf write profile not understood: {}'.format(self.profile))
+        # variables along an unlimited dimension are always chunked
+        options = WRITE_PROFILES[self.profile]
+        if len(var.dimensions) == 0 or var.datatype == str:
+            return {}
+        unlimited = any([self.ncfile.dimensions[dim].isunlimited() for dim in var.dimensions])
+        if not options['zlib'] and not unlimited:
+            return {}
+        options = dict(options) if options['zlib'] else {}
+        if self.profile in self.CHUNK_SIZES:
+            options['chunksizes'] = tuple(max(1, min(self.get_dimension_size(dim), self.CHUNK_SIZES[self.profile]))
+                                          for dim in var.dimensions)
+        return options
+
+    def get_dimension_size(self, dim):
+        # size of dimension. expected number of records (nrec) for unlimited dimension
+        if self.ncfile.dimensions[dim].isunlimited():
+            return self.nrec
+        return len(self.ncfile.dimensions[dim])
+
     def __write_var(self, var):
         # var.dimensions is a tuple
         # var.type is  a string
         # print('Writing', var.name, var.datatype, var.dimensions, var.data)
-        ncvar = self.ncfile.createVariable(var.name, var.datatype, var.dimensions)
-        for key, value in zip(['long_name', 'standard_name', 'units'],
-                              [var.long_name, var.standard_name, var.units]):
-            if value is not None:
-                setattr(ncvar, key, value)
+        if isinstance(var.dimensions, str):
+            # ('time') is a string and not a tuple
+            var.dimensions = (var.dimensions,)
+        options = self.get_write_options(var)
+        if var.datatype != str and np.dtype(var.datatype).kind == 'f':
+            # missing values (pad values in IOS files) are NaN
+            options['fill_value'] = np.nan
+        ncvar = self.ncfile.createVariable(var.name, var.datatype, var.dimensions, **options)
+        for key in self.VARIABLE_ATTRIBUTES:
+            if getattr(var, key) is not None:
+                setattr(ncvar, key, getattr(var, key))
         # setattr(ncvar, 'long_name', var.long_name)
         # setattr(ncvar, 'standard_name', var.standard_name)
         # setattr(ncvar, 'units', var.units)
-        if var.datatype == str:
+        if var.datatype == str and len(var.dimensions) > 0:
+            ncvar[:] = np.array(var.data, dtype=object)
+        elif var.datatype == str:
             ncvar[0] = var.data
         else:
-            setattr(ncvar, 'FillValue', float('NaN'))
-            ncvar[:] = var.data
+            # data of variables with a data source is written by write_chunks
+            if var.source is None:
+                ncvar[:] = var.data
 
 
 class CtdNcFile(OceanNcFile):
+    # profiles are short. one chunk holds a typical cast
+    CHUNK_SIZES = {'balanced': 1024, 'archive': 4096}
+
     def setup_dimensions(self):
         self.ncfile.createDimension('z', self.nrec)
 
@@ -74,8 +166,50 @@ class CtdNcFile(OceanNcFile):
 
 
 class MCtdNcFile(OceanNcFile):
+    # long time series. larger chunks compress better and are read in fewer requests
+    # data is written in chunks along unlimited dimension time
+    CHUNK_SIZES = {'fast': 4096, 'balanced': 8192, 'archive': 65536}
+
     def setup_dimensions(self):
-        self.ncfile.createDimension('time', self.nrec)
+        self.ncfile.createDimension('time', None)
 
     def setup_filetype(self):
         setattr(self.ncfile, 'cdm_timeseries_variables', 'profile')
+
+
+class CurNcFile(OceanNcFile):
+    # current meter time series. data is written in chunks along unlimited dimension time
+    CHUNK_SIZES = {'fast': 4096, 'balanced': 8192, 'archive': 65536}
+
+    def setup_dimensions(self):
+        self.ncfile.createDimension('time', None)
+
+    def setup_filetype(self):
+        setattr(self.ncfile, 'cdm_timeseries_variables', 'profile')
+
+
+class CtdRaggedNcFile(OceanNcFile):
+    # many profiles in one file (CF contiguous ragged array)
+    # profile variables have dimension 'profile'. observations of all profiles are stored one after the other
+    # along 'obs' and rowSize holds the number of observations in each profile
+    CHUNK_SIZES = {'balanced': 16384, 'archive': 65536}
+    # profile is the instance variable (cf_role) and rowSize points to the observation dimension
+    VARIABLE_ATTRIBUTES = OceanNcFile.VARIABLE_ATTRIBUTES + ['cf_role', 'sample_dimension']
+
+    def __init__(self):
+        OceanNcFile.__init__(self)
+        # number of profiles. nrec is the total number of observations
+        self.nprof = 0
+
+    def setup_dimensions(self):
+        self.ncfile.createDimension('profile', self.nprof)
+        self.ncfile.createDimension('obs', self.nrec)
+
+    def setup_filetype(self):
+        setattr(self.ncfile, 'cdm_profile_variables', 'time, profile')
+
+    def write_header(self):
+        # header of each profile is written in variable header (see write_ctd_ragged_ncfile)
+        # no global HEADER attribute
+        if self.header_format not in HEADER_FORMATS:
+            raise Exception('header format not understood: {}'.format(self.header_format))
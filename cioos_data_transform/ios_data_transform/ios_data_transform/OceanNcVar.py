@@ -3,12 +3,17 @@
 from datetime import datetime
 from pytz import timezone
 import numpy as np
+from .fixed_width import pad_value
+from .channel_table import BODC_RULES, NcVarList, get_bodc_rule, get_bodc_code
 
 
 class OceanNcVar(object):
     def __init__(self, vartype, varname, varunits, varmin, varmax, varval, varclslist=[], vardim=(),
                  varnull=float("nan")):
         self.cf_role = None
+        self.sample_dimension = None
+        # function returning data for a chunk of records (see get_chunk). used when data is written in chunks
+        self.source = None
         self.name = varname
         self.type = vartype
         self.standard_name = None
@@ -22,9 +27,11 @@ class OceanNcVar(object):
         self.data = varval
         # from existing varlist. get all variables that are going to be written into the ncfile
         # this will be checked to make sure new variable name does not conflict with existing ones
-        varlist = []
-        for v in varclslist:
-            varlist.append(v.name)
+        # NcVarList keeps a set of the names so that the list is not scanned for each new variable
+        if isinstance(varclslist, NcVarList):
+            varlist = varclslist.names
+        else:
+            varlist = set([v.name for v in varclslist])
         self.add_var(varlist)
 
     def add_var(self, varlist):
@@ -47,6 +54,42 @@ class OceanNcVar(object):
         elif self.type == 'profile':
             self.datatype = str
             self.cf_role = 'profile_id'
+        elif self.type == 'row_size':
+            # number of observations in each profile of a contiguous ragged array
+            self.datatype = 'int32'
+            self.long_name = 'Number of observations for this profile'
+            self.sample_dimension = 'obs'
+        elif self.type == 'speed':
+            self.name = 'LCSAAP01'
+            self.datatype = 'float32'
+            self.long_name = 'Sea Water Speed'
+            self.standard_name = 'sea_water_speed'
+            self.units = self.__get_speed_units()
+            self.__set_null_val()
+        elif self.type == 'direction':
+            self.name = 'LCDAAP01'
+            self.datatype = 'float32'
+            self.long_name = 'Direction of Sea Water Velocity'
+            self.standard_name = 'direction_of_sea_water_velocity'
+            if self.units.strip().lower() in ['degrees', 'deg', 'degree']:
+                self.units = 'degrees'
+            else:
+                raise Exception('Unclear units for current direction!')
+            self.__set_null_val()
+        elif self.type == 'u':
+            self.name = 'LCEWAP01'
+            self.datatype = 'float32'
+            self.long_name = 'Eastward Sea Water Velocity'
+            self.standard_name = 'eastward_sea_water_velocity'
+            self.units = self.__get_speed_units()
+            self.__set_null_val()
+        elif self.type == 'v':
+            self.name = 'LCNSAP01'
+            self.datatype = 'float32'
+            self.long_name = 'Northward Sea Water Velocity'
+            self.standard_name = 'northward_sea_water_velocity'
+            self.units = self.__get_speed_units()
+            self.__set_null_val()
         elif self.type == 'instr_depth':
             self.datatype = 'float32'
             self.long_name = 'Instrument Depth'
@@ -67,9 +110,7 @@ class OceanNcVar(object):
             self.standard_name = 'time'
             self.long_name = 'time'
             self.units = 'seconds since 1970-01-01 00:00:00+0000'
-            dt = np.asarray(self.data)  # datetime.datetime.strptime(self.data, '%Y/%m/%d %H:%M:%S.%f %Z')
-            buf = dt - timezone('UTC').localize(datetime(1970, 1, 1, 0, 0, 0))
-            self.data = [i.total_seconds() for i in buf]
+            self.data = self.time_to_seconds(self.data)
             # self.data = (dt - datetime.datetime(1970, 1, 1).astimezone(timezone('UTC'))).total_seconds()
         elif self.type == 'depth':
             self.datatype = 'float32'
@@ -89,170 +130,58 @@ class OceanNcVar(object):
                 raise Exception('Unclear units for pressure!')
             self.standard_name = 'sea_water_pressure'
             self.__set_null_val()
-        elif self.type == 'temperature':
+        elif self.type in BODC_RULES:
+            # temperature, salinity, oxygen, conductivity and nutrients
+            # BODC code, units and CF attributes are taken from the table in channel_table.py
             self.datatype = 'float32'
             # self.dimensions = ('z')
-            for i in range(4):
-                bodc_code, bodc_units = self.__get_bodc_code(self.type, self.name, self.units, i)
-                if bodc_code not in varlist:
-                    break
-            self.name = bodc_code
-            self.long_name = 'Sea Water Temperature'
-            self.standard_name = 'sea_water_temperature'
-            self.units = bodc_units
-            self.__set_null_val()
-        elif self.type == 'salinity':
-            self.datatype = 'float32'
-            # self.dimensions = ('z')
-            for i in range(4):  # will try to get a unique variable name at least 4 times
-                bodc_code, bodc_units = self.__get_bodc_code(self.type, self.name, self.units, i)
-                if bodc_code not in varlist:
-                    break
-            self.name = bodc_code
-            self.long_name = 'Sea Water Practical Salinity'
-            self.standard_name = 'sea_water_practical_salinity'
-            self.units = bodc_units
-            self.__set_null_val()
-        elif self.type == 'oxygen':
-            self.datatype = 'float32'
-            # self.dimensions = ('z')
-            for i in range(4):  # will try to get a unique variable name at least 4 times
-                bodc_code, bodc_units = self.__get_bodc_code(self.type, self.name, self.units, i)
-                if bodc_code not in varlist:
-                    break
-            self.name = bodc_code
-            self.long_name = 'Oxygen concentration'
-            self.standard_name = 'dissolved_oxygen_concentration'
-            self.units = bodc_units
-            self.__set_null_val()
-        elif self.type == 'conductivity':
-            self.datatype = 'float32'
-            # self.dimensions = ('z')
-            for i in range(4):  # will try to get a unique variable name at least 4 times
-                bodc_code, bodc_units = self.__get_bodc_code(self.type, self.name, self.units, i)
-                if bodc_code not in varlist:
-                    break
-            self.name = bodc_code
-            self.long_name = 'Sea Water Electrical Conductivity'
-            self.standard_name = 'sea_water_electrical_conductivity'
-            self.units = bodc_units
-            self.__set_null_val()
-        elif self.type == 'nutrient':
-            self.datatype = 'float32'
-            for i in range(4):
-                bodc_code, bodc_units = self.__get_bodc_code(self.type, self.name, self.units, i)
-                if bodc_code not in varlist:
-                    break
-            self.name = bodc_code
-            self.units = bodc_units
+            rule = get_bodc_rule(self.type, self.name, self.units)
+            self.name = get_bodc_code(rule, varlist)
+            self.long_name = rule.long_name
+            self.standard_name = rule.standard_name
+            self.units = rule.units
             self.__set_null_val()
         else:
             print("Do not know how to define this variable..")
             raise Exception("Fatal Error")
 
     def __set_null_val(self):
-        self.data = np.asarray(self.data, dtype=float)
-        try:
-            self.data[self.data == float(self.null_value)] = float("nan")
-        except Exception as e:
-            print("Pad field is empty. Setting FillValue to NaN ...")
+        self.data = self.mask_null(self.data)
 
-    def __get_bodc_code(self, vartype, ios_varname, varunits, iter):
-        """
-        return the correct BODC code based on variable type, units and ios variable name
-        author: Pramod Thupaki pramod.thupaki@hakai.org
-        inputs:
-            varname:
-            vartype: list. [0] = vartype, [1]=instance details (primary/secondary etc)
-            varunits:
-        output:
-            BODC code
-        """
-        from .utils import is_in
-        bodc_code = '';
-        bodc_units = ''
-        if vartype == 'temperature':
-            if is_in(['reversing'], ios_varname) and is_in(['deg c'], varunits):
-                bodc_code = 'TEMPRTN';
-                bodc_units = 'deg C'
-                bodc_code = '{}{:01d}'.format(bodc_code, iter + 1)
-            elif is_in(['ITS90', 'ITS-90'], varunits):
-                bodc_code = 'TEMPS9';
-                bodc_units = 'deg C'
-                bodc_code = '{}{:02d}'.format(bodc_code, iter + 1)
-            elif is_in(['IPTS-68', 'IPTS68'], varunits):
-                bodc_code = 'TEMPS6';
-                bodc_units = 'deg C'
-                bodc_code = '{}{:02d}'.format(bodc_code, iter + 1)
-            elif is_in(['deg c', 'degc'], varunits):
-                bodc_code = 'TEMPST';
-                bodc_units = 'deg C'
-                bodc_code = '{}{:02d}'.format(bodc_code, iter + 1)
-            else:  # if varunits does not specify type of temperature
-                raise Exception("Temperature type not defined", ios_varname, varunits, vartype)
+    def mask_null(self, data):
+        # convert data to float and replace pad values (null_value) with NaN
+        # data read by ObsFile is already masked (see ObsFile.mask_pad). float32 and float64 data are not copied
+        # blank pad (e.g. ' ') means the data has no pad values
+        data = np.asarray(data)
+        if data.dtype.kind != 'f':
+            data = data.astype(float)
+        null_value = pad_value(self.null_value)
+        if not np.isnan(null_value):
+            data[data == data.dtype.type(null_value)] = float("nan")
+        return data
 
-        elif vartype == 'salinity':
-            if not is_in(['bottle'], ios_varname) and is_in(['PSS-78'], varunits):
-                bodc_code = "PSALST";
-                bodc_units = 'PSS-78'
-                bodc_code = '{}{:02d}'.format(bodc_code, iter + 1)
-            elif not is_in(['bottle'], ios_varname) and is_in(['ppt'], varunits):
-                bodc_code = "SSALST";
-                bodc_units = 'PPT'
-                bodc_code = '{}{:02d}'.format(bodc_code, iter + 1)
-            elif is_in(['bottle'], ios_varname) and is_in(['PSS-78'], varunits):
-                bodc_code = "PSALBST";
-                bodc_units = 'PSS-78'
-                bodc_code = '{}{:01d}'.format(bodc_code, iter + 1)
-            elif is_in(['bottle'], ios_varname) and is_in(['ppt'], varunits):
-                bodc_code = "ODSDM021";
-                bodc_units = 'PPT'
+    def time_to_seconds(self, data):
+        # convert list of datetime objects or datetime64 array (UTC) to seconds since 1970-01-01
+        dt = np.asarray(data)  # datetime.datetime.strptime(self.data, '%Y/%m/%d %H:%M:%S.%f %Z')
+        if dt.dtype.kind == 'M':
+            # datetime64 array (UTC). converted without creating datetime objects
+            return (dt - np.datetime64('1970-01-01T00:00:00', 'us')) / np.timedelta64(1, 's')
+        buf = dt - timezone('UTC').localize(datetime(1970, 1, 1, 0, 0, 0))
+        return [i.total_seconds() for i in buf]
 
-            else:
-                raise Exception("Salinity type not defined", ios_varname, varunits, vartype)
+    def get_chunk(self, start, block):
+        # returns data to be written for a chunk of records
+        # source returns data for the chunk (e.g. column of block). start is index of first record in chunk
+        data = self.source(start, block)
+        if self.type == 'time':
+            return self.time_to_seconds(data)
+        return self.mask_null(data)
 
-        elif vartype == 'oxygen':
-            if is_in(['ml/l'], varunits):
-                bodc_code = "DOXYZZ";
-                bodc_units = 'mL/L'
-            elif is_in(['umol/kg'], varunits):
-                bodc_code = "DOXMZZ";
-                bodc_units = 'umol/kg'
-            elif is_in(['umol/L'], varunits):
-                bodc_code = "DOXY";
-                bodc_units = 'umol/L'
-            else:
-                raise Exception("Oxygen units not defined", ios_varname, varunits, vartype)
-            bodc_code = '{}{:02d}'.format(bodc_code, iter + 1)
-        elif vartype == 'conductivity':
-            if is_in(['s/m'], varunits):
-                bodc_code = 'CNDCST';
-                bodc_units = 'S/m'
-            elif is_in(['ms/cm'], varunits):
-                bodc_code = 'CNDCSTX';
-                bodc_units = 'mS/cm'
-            else:
-                raise Exception("Conductivity units not compatible with BODC code", ios_varname, varunits, vartype)
-            bodc_code = '{}{:02d}'.format(bodc_code, iter + 1)
-        elif vartype == 'nutrient':
-            if is_in(['nitrate_plus_nitrite'], ios_varname) and is_in(['umol/l'], varunits):
-                bodc_code = 'NTRZAAZ';
-                bodc_units = 'umol/L'
-                self.standard_name = 'mole_concentration_of_nitrate_and_nitrite_in_sea_water'
-                self.long_name = 'Mole Concentration of Nitrate and Nitrite in Sea Water'
-            elif is_in(['phosphate'], ios_varname) and is_in(['umol/l'], varunits):
-                bodc_code = 'PHOSAAZ';
-                bodc_units = 'umol/L'
-                self.standard_name = 'mole_concentration_of_phosphate_in_sea_water'
-                self.long_name = 'Mole Concentration of Phosphate in Sea Water'
-            elif is_in(['silicate'], ios_varname) and is_in(['umol/l'], varunits):
-                bodc_code = 'SLCAAAZ';
-                bodc_units = 'umol/L'
-                self.standard_name = 'mole_concentration_of_silicate_in_sea_water'
-                self.long_name = 'Mole Concentration of Silicate in Sea Water'
-            else:
-                raise Exception("Nutrient units not compatible with BODC code", ios_varname, varunits, vartype)
-            bodc_code = '{}{:01d}'.format(bodc_code, iter + 1)
+    def __get_speed_units(self):
+        # units of current speed and velocity components
+        if self.units.strip().lower() in ['m/s', 'm/sec']:
+            return 'm/s'
+        elif self.units.strip().lower() in ['cm/s', 'cm/sec']:
+            return 'cm/s'
         else:
-            raise Exception('Cannot find BODC code for this variable', ios_varname, varunits, vartype)
-        return bodc_code, bodc_units
+            raise Exception('Unclear units for current speed!')
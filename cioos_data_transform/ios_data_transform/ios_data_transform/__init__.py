@@ -1,4 +1,14 @@
-from .ObsFile import CtdFile, MCtdFile, BotFile
+__version__ = '0.0.1'
+
+from .ObsFile import CtdFile, MCtdFile, BotFile, CurFile
 from .write_ctd_ncfile import write_ctd_ncfile
 from .write_mctd_ncfile import write_mctd_ncfile
+from .write_cur_ncfile import write_cur_ncfile
+from .write_ctd_ragged_ncfile import write_ctd_ragged_ncfile, group_ctd_files
+from .scan_headers import scan_headers
+from .ios_dates import parse_date, parse_dates
+from .manifest import ConversionManifest
+from .header_cache import HeaderCache
+from .instrumentation import ConversionMetrics, JsonLinesSink, PrometheusSink
 from .utils import import_env_variables, is_in, file_mod_time, read_geojson, find_geographic_area, compare_file_list
+from .utils import find_geographic_areas
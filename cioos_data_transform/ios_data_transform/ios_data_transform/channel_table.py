@@ -0,0 +1,161 @@
+"""
+    Tables used to map IOS channels to netcdf variables
+    CHANNEL_RULES gives the variable type (and name) of a channel for each writer (ctd, mctd and cur)
+    BODC_RULES gives the BODC code, units and CF attributes of a variable from its type, channel name and units
+    Rules are checked in order and the first match is used. Results are kept in a process-wide LRU cache
+    since channel names and units repeat across files
+"""
+from collections import namedtuple
+from functools import lru_cache
+from .utils import is_in
+
+# rule to find variable type of a channel. channel name must contain one of include and none of exclude
+# name: name of the variable passed to OceanNcVar. None to use the channel name
+ChannelRule = namedtuple('ChannelRule', ['vartype', 'include', 'exclude', 'name'])
+
+CHANNEL_RULES = {
+    # CTD profiles and bottle files (write_ctd_ncfile)
+    'ctd': (
+        ChannelRule('depth', ('depth',), ('nominal',), 'depth'),
+        ChannelRule('pressure', ('pressure',), (), 'pressure'),
+        ChannelRule('temperature', ('temperature',), ('flag', 'rinko', 'bottle'), None),
+        ChannelRule('salinity', ('salinity',), ('flag',), None),
+        ChannelRule('oxygen', ('oxygen',),
+                    ('flag', 'bottle', 'rinko', 'temperature', 'current', 'isotope', 'saturation'), None),
+        ChannelRule('conductivity', ('conductivity',), (), None),
+        # nutrients in bottle files
+        ChannelRule('nutrient', ('nitrate_plus_nitrite', 'silicate', 'phosphate'), ('flag',), None),
+    ),
+    # CTDs on moorings (write_mctd_ncfile)
+    'mctd': (
+        ChannelRule('depth', ('depth',), (), 'depth'),
+        ChannelRule('pressure', ('pressure',), (), 'pressure'),
+        ChannelRule('temperature', ('temperature',), ('flag', 'bottle'), None),
+        ChannelRule('salinity', ('salinity',), ('flag', 'bottle'), None),
+        ChannelRule('oxygen', ('oxygen',), ('flag', 'bottle', 'rinko', 'temperature', 'current'), None),
+        ChannelRule('conductivity', ('conductivity',), (), None),
+    ),
+    # current meters (write_cur_ncfile)
+    'cur': (
+        ChannelRule('speed', ('speed',), ('sound', 'flag'), None),
+        ChannelRule('direction', ('direction',), ('from', 'flag'), None),
+        ChannelRule('pressure', ('pressure',), (), None),
+        ChannelRule('temperature', ('temperature',), ('flag', 'bottle'), None),
+        ChannelRule('salinity', ('salinity',), ('flag', 'bottle'), None),
+        ChannelRule('conductivity', ('conductivity',), ('ratio',), None),
+    ),
+}
+
+# rule to find the BODC code of a variable. channel name must contain one of name_include (if any) and
+# none of name_exclude. units must contain one of units_include
+# code is prefix followed by a counter with digits digits (0: no counter) that makes the variable name unique
+# long_name and standard_name are None to use the attributes of the variable type (CF_ATTRIBUTES)
+BodcRule = namedtuple('BodcRule', ['name_include', 'name_exclude', 'units_include', 'prefix', 'digits', 'units',
+                                   'long_name', 'standard_name'])
+
+BODC_RULES = {
+    'temperature': (
+        BodcRule(('reversing',), (), ('deg c',), 'TEMPRTN', 1, 'deg C', None, None),
+        BodcRule((), (), ('ITS90', 'ITS-90'), 'TEMPS9', 2, 'deg C', None, None),
+        BodcRule((), (), ('IPTS-68', 'IPTS68'), 'TEMPS6', 2, 'deg C', None, None),
+        BodcRule((), (), ('deg c', 'degc'), 'TEMPST', 2, 'deg C', None, None),
+    ),
+    'salinity': (
+        BodcRule((), ('bottle',), ('PSS-78',), 'PSALST', 2, 'PSS-78', None, None),
+        BodcRule((), ('bottle',), ('ppt',), 'SSALST', 2, 'PPT', None, None),
+        BodcRule(('bottle',), (), ('PSS-78',), 'PSALBST', 1, 'PSS-78', None, None),
+        BodcRule(('bottle',), (), ('ppt',), 'ODSDM021', 0, 'PPT', None, None),
+    ),
+    'oxygen': (
+        BodcRule((), (), ('ml/l',), 'DOXYZZ', 2, 'mL/L', None, None),
+        BodcRule((), (), ('umol/kg',), 'DOXMZZ', 2, 'umol/kg', None, None),
+        BodcRule((), (), ('umol/L',), 'DOXY', 2, 'umol/L', None, None),
+    ),
+    'conductivity': (
+        BodcRule((), (), ('s/m',), 'CNDCST', 2, 'S/m', None, None),
+        BodcRule((), (), ('ms/cm',), 'CNDCSTX', 2, 'mS/cm', None, None),
+    ),
+    'nutrient': (
+        BodcRule(('nitrate_plus_nitrite',), (), ('umol/l',), 'NTRZAAZ', 1, 'umol/L',
+                 'Mole Concentration of Nitrate and Nitrite in Sea Water',
+                 'mole_concentration_of_nitrate_and_nitrite_in_sea_water'),
+        BodcRule(('phosphate',), (), ('umol/l',), 'PHOSAAZ', 1, 'umol/L',
+                 'Mole Concentration of Phosphate in Sea Water', 'mole_concentration_of_phosphate_in_sea_water'),
+        BodcRule(('silicate',), (), ('umol/l',), 'SLCAAAZ', 1, 'umol/L',
+                 'Mole Concentration of Silicate in Sea Water', 'mole_concentration_of_silicate_in_sea_water'),
+    ),
+}
+
+# long_name and standard_name of variable types with BODC codes
+CF_ATTRIBUTES = {
+    'temperature': ('Sea Water Temperature', 'sea_water_temperature'),
+    'salinity': ('Sea Water Practical Salinity', 'sea_water_practical_salinity'),
+    'oxygen': ('Oxygen concentration', 'dissolved_oxygen_concentration'),
+    'conductivity': ('Sea Water Electrical Conductivity', 'sea_water_electrical_conductivity'),
+    'nutrient': (None, None),
+}
+
+# error messages used when no BODC rule matches
+BODC_ERRORS = {
+    'temperature': "Temperature type not defined",
+    'salinity': "Salinity type not defined",
+    'oxygen': "Oxygen units not defined",
+    'conductivity': "Conductivity units not compatible with BODC code",
+    'nutrient': "Nutrient units not compatible with BODC code",
+}
+
+
+@lru_cache(maxsize=1024)
+def classify_channel(channel, ruleset):
+    # returns ChannelRule of channel (name) for ruleset ('ctd', 'mctd' or 'cur'). None if channel is not converted
+    for rule in CHANNEL_RULES[ruleset]:
+        if is_in(rule.include, channel) and not is_in(rule.exclude, channel):
+            return rule
+    return None
+
+
+@lru_cache(maxsize=1024)
+def get_bodc_rule(vartype, ios_varname, varunits):
+    # returns BodcRule for variable type, ios channel name and units. long_name and standard_name are set
+    # raises Exception if the units (or name) do not match any rule
+    if vartype not in BODC_RULES:
+        raise Exception('Cannot find BODC code for this variable', ios_varname, varunits, vartype)
+    for rule in BODC_RULES[vartype]:
+        if len(rule.name_include) > 0 and not is_in(rule.name_include, ios_varname):
+            continue
+        if is_in(rule.name_exclude, ios_varname) or not is_in(rule.units_include, varunits):
+            continue
+        if rule.long_name is None:
+            rule = rule._replace(long_name=CF_ATTRIBUTES[vartype][0], standard_name=CF_ATTRIBUTES[vartype][1])
+        return rule
+    raise Exception(BODC_ERRORS[vartype], ios_varname, varunits, vartype)
+
+
+def get_bodc_code(rule, names, tries=4):
+    # BODC code of rule that is not in names (set of variable names already in the file)
+    # counter is increased up to tries times. last code is used if none of them is unique
+    for i in range(tries):
+        if rule.digits == 0:
+            return rule.prefix
+        bodc_code = '{}{:0{}d}'.format(rule.prefix, i + 1, rule.digits)
+        if bodc_code not in names:
+            break
+    return bodc_code
+
+
+class NcVarList(list):
+    """
+    List of OceanNcVar objects with a set of the variable names
+    used by OceanNcVar to check that a new variable name does not conflict with existing ones
+    """
+    def __init__(self, iterable=()):
+        list.__init__(self, iterable)
+        self.names = set([var.name for var in self])
+
+    def append(self, var):
+        list.append(self, var)
+        self.names.add(var.name)
+
+    def extend(self, iterable):
+        for var in iterable:
+            self.append(var)
@@ -0,0 +1,405 @@
+"""
+    Functions to decode the fixed width data block of IOS files using numpy
+    The data block is read as a byte buffer and columns are sliced out of it using the
+    widths derived from the FORMAT line (fortran format) or the CHANNEL DETAIL table (struct format)
+    Each column is then converted in bulk instead of line by line
+    Compiled layouts are kept in a process-wide LRU cache since many files share the same FORMAT
+"""
+import re
+from io import BytesIO, TextIOWrapper
+from collections import namedtuple
+from functools import lru_cache
+import fortranformat as ff
+import numpy as np
+
+# maximum number of distinct formats kept in each cache
+FORMAT_CACHE_SIZE = 256
+# lookup table of characters treated as blank (same as str.strip)
+BLANKS = np.zeros(256, dtype=bool)
+BLANKS[[ord(c) for c in ' \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f']] = True
+
+# compiled column layout of a data line
+# offsets, widths and decimals are in characters. dtypes is the numpy type of each decoded column
+# record_length is the number of characters needed to read all the columns
+ColumnLayout = namedtuple('ColumnLayout', ['offsets', 'widths', 'decimals', 'dtypes', 'record_length'])
+
+
+class FormatNotSupported(Exception):
+    """
+    Raised when a format (or the data) cannot be decoded by the vectorized reader
+    The caller is expected to fall back to the line by line readers
+    """
+    pass
+
+
+def compile_fortran_format(formatline):
+    # converts fortran format description, e.g. (F8.1,1X,3E15.7), to a ColumnLayout
+    # spaces (X) only move the offset. Edit descriptors that can not be represented as
+    # fixed columns (/, T, P etc.) raise FormatNotSupported
+    return fortran_layout(formatline.strip().upper().replace(' ', ''))
+
+
+@lru_cache(maxsize=FORMAT_CACHE_SIZE)
+def fortran_layout(fmt):
+    # cached part of compile_fortran_format. fmt is the normalized format line
+    if fmt[0:1] != '(' or fmt[-1:] != ')':
+        raise FormatNotSupported("Format line is not enclosed in brackets: {}".format(fmt))
+    items = expand_fortran_format(fmt[1:-1])
+    offsets, widths, decimals = [], [], []
+    offset = 0
+    for item in items:
+        m = re.match(r'^(\d*)X$', item)
+        if m:
+            offset += int(m.group(1) or 1)
+            continue
+        m = re.match(r'^(ES|EN|[FEDGIA])(\d+)(?:\.(\d+))?(?:E\d+)?$', item)
+        if m is None:
+            raise FormatNotSupported("Edit descriptor not supported: {}".format(item))
+        offsets.append(offset)
+        widths.append(int(m.group(2)))
+        if m.group(1) in ['I', 'A']:
+            decimals.append(0)
+        else:
+            decimals.append(int(m.group(3) or 0))
+        offset += widths[-1]
+    if len(widths) == 0:
+        raise FormatNotSupported("No columns in format: {}".format(fmt))
+    return ColumnLayout(tuple(offsets), tuple(widths), tuple(decimals), ('f8',) * len(widths),
+                        offsets[-1] + widths[-1])
+
+
+@lru_cache(maxsize=FORMAT_CACHE_SIZE)
+def fortran_reader(formatline):
+    # FortranRecordReader for the line by line fallback, created once per format line
+    return ff.FortranRecordReader(formatline)
+
+
+def expand_fortran_format(fmt):
+    # expands repeat counts in a fortran format (without outer brackets)
+    # e.g. '2(F8.1,1X),3I5' -> ['F8.1', '1X', 'F8.1', '1X', 'I5', 'I5', 'I5']
+    items = []
+    i = 0
+    while i < len(fmt):
+        if fmt[i] == ',':
+            i += 1
+            continue
+        m = re.match(r'\d+', fmt[i:])
+        repeat = 1
+        if m and i + m.end() < len(fmt) and fmt[i + m.end()] != 'X':
+            repeat = int(m.group(0))
+            i += m.end()
+        if fmt[i] == '(':
+            # find matching bracket for group
+            depth = 0
+            for j in range(i, len(fmt)):
+                if fmt[j] == '(':
+                    depth += 1
+                elif fmt[j] == ')':
+                    depth -= 1
+                    if depth == 0:
+                        break
+            if depth != 0:
+                raise FormatNotSupported("Unbalanced brackets in format: {}".format(fmt))
+            items.extend(expand_fortran_format(fmt[i + 1:j]) * repeat)
+            i = j + 1
+        else:
+            j = fmt.find(',', i)
+            if j == -1:
+                j = len(fmt)
+            items.extend([fmt[i:j]] * repeat)
+            i = j
+    return items
+
+
+@lru_cache(maxsize=FORMAT_CACHE_SIZE)
+def compile_struct_format(fmt_struct):
+    # converts python struct format created from channel details, e.g. '8s11s9s', to a ColumnLayout
+    # columns are read as fixed width byte strings
+    widths = [int(w) for w in re.findall(r'(\d+)s', fmt_struct)]
+    if len(widths) == 0 or ''.join('{}s'.format(w) for w in widths) != fmt_struct:
+        raise FormatNotSupported("Struct format not supported: {}".format(fmt_struct))
+    offsets = [sum(widths[:i]) for i in range(len(widths))]
+    return ColumnLayout(tuple(offsets), tuple(widths), (0,) * len(widths),
+                        tuple('S{:d}'.format(w) for w in widths), sum(widths))
+
+
+@lru_cache(maxsize=FORMAT_CACHE_SIZE)
+def struct_format_from_channel_detail(types, formats, widths):
+    # creates python 'struct' format from the Type, Format and Width columns of CHANNEL DETAIL
+    # inputs are tuples (hashable) so files with the same channel details share the result
+    fmt = ''
+    for i in range(len(types)):
+        if types[i].strip() == 'D':
+            fmt = fmt + '11s'
+        elif types[i].strip() == 'DT':
+            fmt = fmt + '17s'
+        elif formats[i].strip().upper() == 'HH:MM:SS':
+            fmt = fmt + '9s'
+        elif formats[i].strip().upper() == 'HH:MM':
+            fmt = fmt + '6s'
+        else:
+            fmt = fmt + widths[i].strip() + 's'
+    return fmt
+
+
+@lru_cache(maxsize=FORMAT_CACHE_SIZE)
+def channel_dtypes(types, formats):
+    # numpy type of each channel from the Type and Format columns of CHANNEL DETAIL
+    # dates are datetime64, times of day (HH:MM:SS, HH:MM) are timedelta64, integers are int32
+    # R8 channels are float64 and all other channels are float32
+    dtypes = []
+    for i in range(len(types)):
+        if types[i].strip() == 'D':
+            dtypes.append('datetime64[D]')
+        elif types[i].strip() == 'DT':
+            dtypes.append('datetime64[ms]')
+        elif formats[i].strip().upper() in ['HH:MM:SS', 'HH:MM']:
+            dtypes.append('timedelta64[s]')
+        elif types[i].strip() == 'I' or formats[i].strip().upper().startswith('I'):
+            dtypes.append('int32')
+        elif types[i].strip() == 'R8':
+            dtypes.append('float64')
+        else:
+            dtypes.append('float32')
+    return tuple(dtypes)
+
+
+def to_typed(column, dtype):
+    # converts fixed width byte string column (e.g. from read_struct_columns) to dtype in bulk
+    # blank fields are NaN for float and NaT for dates and times
+    # raises FormatNotSupported if the column can not be converted
+    dtype = np.dtype(dtype)
+    if column.dtype.kind == 'U':
+        column = np.char.encode(column, 'ascii')
+    try:
+        if dtype.kind == 'M':
+            # YYYY/MM/DD or YYYY/MM/DD HH:MM(:SS)
+            text = np.char.replace(np.char.replace(np.char.strip(column), b'/', b'-'), b' ', b'T')
+            text[text == b''] = b'NaT'
+            return text.astype(dtype)
+        elif dtype.kind == 'm':
+            # HH:MM:SS or HH:MM
+            text = np.char.strip(column)
+            blank = text == b''
+            text[blank] = b'0'
+            with_seconds = np.char.count(text, b':') == 2
+            value = np.char.replace(text, b':', b'').astype('int64')
+            seconds = np.where(with_seconds, value // 10000 * 3600 + value // 100 % 100 * 60 + value % 100,
+                               value // 100 * 3600 + value % 100 * 60).astype(dtype)
+            seconds[blank] = np.timedelta64('NaT')
+            return seconds
+        elif dtype.kind == 'f':
+            try:
+                return column.astype(dtype)
+            except ValueError:
+                text = np.char.strip(column)
+                text[text == b''] = b'nan'
+                return text.astype(dtype)
+        return column.astype(dtype)
+    except ValueError as e:
+        raise FormatNotSupported(str(e))
+
+
+def combine_date_time(dates, times=None):
+    # time of each record (datetime64[ms]) from a date column (datetime64) and a time of day column (timedelta64)
+    # times is None if dates include the time of day (DT channels). record is NaT if date or time is missing
+    dates = np.asarray(dates).astype('datetime64[ms]')
+    if times is None:
+        return dates
+    return dates + np.asarray(times).astype('timedelta64[ms]')
+
+
+@lru_cache(maxsize=FORMAT_CACHE_SIZE)
+def table_spans(mask):
+    # column spans (start, end) of a header table from the dash line below the column names
+    # e.g. '    !--- ----  -----' -> ((5, 8), (9, 13), (15, 20)). positions are characters in the line
+    return tuple((m.start(), m.end()) for m in re.finditer('-+', mask.rstrip()))
+
+
+# patterns used to find the type of columns in header tables (see typed_table_column)
+TABLE_TYPES = [
+    ('int64', re.compile(r'^[+-]?\d+$')),
+    ('float64', re.compile(r'^[+-]?(\d+\.?\d*|\.\d+)([eEdD][+-]?\d+)?$')),
+    ('datetime64[D]', re.compile(r'^\d{4}/\d{2}/\d{2}$')),
+    ('datetime64[s]', re.compile(r'^\d{4}/\d{2}/\d{2} \d{2}:\d{2}(:\d{2})?$')),
+    ('timedelta64[s]', re.compile(r'^\d{1,2}:\d{2}(:\d{2})?$')),
+]
+# values treated as missing in header tables
+TABLE_MISSING = ['', '?', 'n/a', 'N/A']
+# columns that are always read as strings (names, versions and serial numbers can look like numbers)
+TABLE_TEXT_COLUMNS = ['Name', 'Units', 'Vers', 'Serial No', 'Format', 'Type']
+
+
+def typed_table_column(values, name=None):
+    # converts column of a header table (list of strings, see ObsFile.split_table) to a numpy array
+    # type is the first of TABLE_TYPES that matches all values that are not missing (TABLE_MISSING)
+    # missing values are NaN (or NaT). integer columns with missing values are float
+    # columns in TABLE_TEXT_COLUMNS or that do not match any type are strings without quotes (e.g. ' ' is '')
+    text = [v.strip().strip("'").strip() for v in values]
+    if name in TABLE_TEXT_COLUMNS:
+        return np.array(text)
+    present = [t for t in text if t not in TABLE_MISSING]
+    if len(present) == 0:
+        return np.full(len(text), np.nan)
+    for dtype, pattern in TABLE_TYPES:
+        if not all([pattern.match(t) is not None for t in present]):
+            continue
+        if dtype == 'int64' and len(present) == len(text):
+            return np.array(text, dtype=dtype)
+        elif dtype in ['int64', 'float64']:
+            return np.array([float(t.replace('D', 'E').replace('d', 'e')) if t not in TABLE_MISSING else np.nan
+                             for t in text])
+        return to_typed(np.array([b'' if t in TABLE_MISSING else t.encode('ascii') for t in text]), dtype)
+    return np.array(text)
+
+
+def pad_value(pad):
+    # pad value (PAD in FILE or Pad in CHANNEL DETAIL) as float. NaN if pad is blank (e.g. ' ') or not a number
+    if pad is None:
+        return float('nan')
+    try:
+        return float(str(pad).strip().strip("'").strip())
+    except ValueError:
+        return float('nan')
+
+
+def mask_pad(data, pads, dtype=np.float32):
+    # returns data (2D array of records x channels, or a column) as dtype with pad values replaced by NaN
+    # pads: pad value of each channel (NaN for channels without pad). all channels are compared in one operation
+    # pad is compared in the type of data so that values decoded as float32 match the pad
+    # result is column-major. data is changed in place if it is already of dtype in column-major order
+    data = np.asarray(data)
+    if data.dtype.kind != 'f':
+        data = data.astype(float)
+    pads = np.asarray(pads, dtype=data.dtype)
+    out = np.asfortranarray(data, dtype=dtype)
+    out[data == pads] = np.nan
+    return out
+
+
+def lines_to_array(lines, width):
+    # converts list of lines (without end of line characters) to 2D array of characters (uint8)
+    # every line is padded with spaces (or clipped) to width
+    # returns array with shape (nlines, width)
+    buf = ''.join(lines).encode('ascii', errors='ignore')
+    lengths = np.fromiter((len(l) for l in lines), dtype=int, count=len(lines))
+    if len(lines) > 0 and (lengths == lengths[0]).all() and len(buf) == lengths.sum():
+        # all lines have the same length. reshape the buffer directly
+        chars = np.frombuffer(buf, dtype=np.uint8).reshape((len(lines), lengths[0]))
+        return fit_width(chars, width)
+    buf = ''.join([l.ljust(width)[:width] for l in lines]).encode('ascii', errors='ignore')
+    if len(buf) != width * len(lines):
+        raise FormatNotSupported("Data block contains non ascii characters")
+    return np.frombuffer(buf, dtype=np.uint8).reshape((len(lines), width))
+
+
+def slice_columns(chars, layout):
+    # returns list of fixed width byte string arrays, one for each column in layout
+    # chars is 2D array of characters returned by lines_to_array
+    ret = []
+    for offset, width in zip(layout.offsets, layout.widths):
+        ret.append(np.ascontiguousarray(chars[:, offset:offset + width]).view('S{:d}'.format(width)).ravel())
+    return ret
+
+
+def to_float(column, decimals):
+    # converts byte string array to float in bulk
+    # fortran reads numbers without a decimal point as scaled by 10^-decimals.
+    # this case (and blank fields) is left to the fortran reader
+    if decimals > 0 and not (np.char.find(column, b'.') >= 0).all():
+        raise FormatNotSupported("Fields without decimal point")
+    try:
+        return column.astype(float)
+    except ValueError as e:
+        raise FormatNotSupported(str(e))
+
+
+def decode_lines(buf):
+    # convert bytes to list of lines. same rules as reading the file in text mode
+    return TextIOWrapper(BytesIO(buf), encoding='ASCII', errors='ignore').readlines()
+
+
+def block_to_array(block):
+    # converts data block (uint8 array of the bytes after *END OF HEADER) to 2D array of characters
+    # without creating python strings. end of line characters are removed
+    # returns None if the lines are not all of the same length or the block needs to be decoded as text
+    # (non-ascii characters, missing end of line at end of file etc.)
+    if len(block) == 0 or block[-1] != ord('\n'):
+        return None
+    eol = np.flatnonzero(block == ord('\n'))
+    length = eol[0] + 1
+    if len(block) != length * len(eol) or not (np.diff(eol) == length).all():
+        return None
+    if (block > 127).any():
+        return None
+    chars = block.reshape((len(eol), length))[:, :-1]
+    if chars.shape[1] > 0 and (chars[:, -1] == ord('\r')).all():
+        chars = chars[:, :-1]
+    if (chars == ord('\r')).any():
+        return None
+    return chars
+
+
+def fit_width(chars, width):
+    # clip or pad (with spaces) 2D array of characters to width
+    if chars.shape[1] >= width:
+        return chars[:, :width]
+    out = np.full((chars.shape[0], width), ord(' '), dtype=np.uint8)
+    out[:, :chars.shape[1]] = chars
+    return out
+
+
+def read_fortran_columns(lines, formatline):
+    # decode data lines using fortran format description in FORMAT
+    # lines is list of lines or data block as uint8 array (e.g. memory-mapped file)
+    # returns 2D float array (nlines, ncolumns) in column-major (fortran) order. columns are contiguous
+    # raises FormatNotSupported if the data can not be decoded reliably without the fortran reader
+    layout = compile_fortran_format(formatline)
+    width = layout.record_length
+    chars = None
+    if isinstance(lines, np.ndarray):
+        chars = block_to_array(lines)
+        if chars is None:
+            lines = decode_lines(lines.tobytes())
+    if chars is None:
+        lines = [l.rstrip('\r\n') for l in lines]
+        if len(lines) == 0:
+            raise FormatNotSupported("No data lines found")
+        if min(len(l) for l in lines) < width:
+            raise FormatNotSupported("Data lines shorter than format")
+        chars = lines_to_array(lines, width)
+    elif chars.shape[1] < width:
+        raise FormatNotSupported("Data lines shorter than format")
+    else:
+        chars = chars[:, :width]
+    data = [to_float(c, layout.decimals[i]) for i, c in enumerate(slice_columns(chars, layout))]
+    return np.array(data).T
+
+
+def read_struct_columns(lines, fmt_struct):
+    # decode data lines using struct format created from channel details
+    # lines is list of lines or data block as uint8 array (e.g. memory-mapped file)
+    # lines with less than 2 non-blank characters are skipped
+    # returns 2D array of fixed width byte strings (nlines, ncolumns)
+    layout = compile_struct_format(fmt_struct)
+    width = layout.record_length
+    chars = None
+    if isinstance(lines, np.ndarray):
+        chars = block_to_array(lines)
+        if chars is None:
+            lines = decode_lines(lines.tobytes())
+    if chars is None:
+        lines = [l.rstrip('\r\n') for l in lines if len(l.strip()) > 1]
+        if len(lines) == 0:
+            raise FormatNotSupported("No data lines found")
+        if any([l[width:].strip() != '' for l in lines if len(l) > width]):
+            raise FormatNotSupported("Data lines longer than format")
+        chars = lines_to_array(lines, width)
+    else:
+        chars = chars[(~BLANKS[chars]).sum(axis=1) > 1]
+        if len(chars) == 0:
+            raise FormatNotSupported("No data lines found")
+        if chars.shape[1] > width and not BLANKS[chars[:, width:]].all():
+            raise FormatNotSupported("Data lines longer than format")
+        chars = fit_width(chars, width)
+    return np.column_stack(slice_columns(chars, layout))
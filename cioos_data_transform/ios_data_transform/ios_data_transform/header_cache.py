@@ -0,0 +1,107 @@
+"""
+    Persistent cache of parsed IOS headers
+    Header sections parsed by import_data (file, location, channels, channel details etc.) are pickled to a folder
+    so that files that are converted again (e.g. after a change to the writers) do not parse the header again
+    Entries are keyed by path, size and modification time of the file, version of the parser and file class
+    Least recently used entries are removed when the folder is larger than max_bytes
+"""
+import hashlib
+import os
+import pickle
+
+# increase when the parsed header structures change. entries written by other versions are ignored
+PARSER_VERSION = 2
+
+
+class HeaderCache(object):
+    def __init__(self, folder, max_bytes=256 * 1024 * 1024):
+        # folder: location of cache files. created if it does not exist
+        # max_bytes: maximum size of the cache. least recently used entries are removed above this size
+        from . import __version__
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.version = '{}-{}'.format(__version__, PARSER_VERSION)
+        os.makedirs(folder, exist_ok=True)
+        # size of cache. updated as entries are added (other processes may add entries too)
+        self.size = sum([size for _, size, _ in self.list_entries()])
+
+    def get_key(self, filename, name):
+        # key of entry for file and name of file class. None if file does not exist
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        return os.path.abspath(filename), name, stat.st_size, stat.st_mtime_ns, self.version
+
+    def get_entry(self, filename, name):
+        # cache file used for file and name of file class
+        digest = hashlib.sha1('{}:{}'.format(os.path.abspath(filename), name).encode('utf-8')).hexdigest()
+        return os.path.join(self.folder, digest + '.pkl')
+
+    def get(self, filename, name):
+        # returns dictionary of parsed header (see put) or None if the file is not cached or has changed
+        entry = self.get_entry(filename, name)
+        try:
+            with open(entry, 'rb') as fid:
+                key, header = pickle.load(fid)
+        except Exception as e:
+            return None
+        if key != self.get_key(filename, name):
+            return None
+        try:
+            # entry is marked as recently used
+            os.utime(entry)
+        except OSError:
+            pass
+        return header
+
+    def put(self, filename, name, header):
+        # save dictionary of parsed header for file. name: name of file class (headers are parsed differently)
+        key = self.get_key(filename, name)
+        if key is None:
+            return
+        entry = self.get_entry(filename, name)
+        # written to a temporary file and renamed so that other processes never read a partial entry
+        buf = pickle.dumps((key, header), protocol=pickle.HIGHEST_PROTOCOL)
+        temp = '{}.{}.tmp'.format(entry, os.getpid())
+        with open(temp, 'wb') as fid:
+            fid.write(buf)
+        os.replace(temp, entry)
+        self.size = self.size + len(buf)
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def list_entries(self):
+        # returns list of (cache file, size, last use) for all entries
+        entries = []
+        for fn in os.listdir(self.folder):
+            if not fn.endswith('.pkl'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.folder, fn))
+            except OSError:
+                continue
+            entries.append((os.path.join(self.folder, fn), stat.st_size, stat.st_mtime))
+        return entries
+
+    def evict(self):
+        # remove least recently used entries until the cache uses less than 90% of max_bytes
+        entries = sorted(self.list_entries(), key=lambda e: e[2])
+        self.size = sum([size for _, size, _ in entries])
+        for entry, size, _ in entries:
+            if self.size <= 0.9 * self.max_bytes:
+                break
+            try:
+                os.remove(entry)
+            except OSError:
+                pass
+            self.size = self.size - size
+
+    def clear(self):
+        # remove all entries
+        for entry, _, _ in self.list_entries():
+            try:
+                os.remove(entry)
+            except OSError:
+                pass
+        self.size = 0
@@ -0,0 +1,160 @@
+"""
+    Timing and counters for file conversions
+    ConversionMetrics records duration of each stage, bytes read and written, number of records, method used to
+    read the data block and the exception that stopped the conversion (if any) for one file
+    results of a batch of files are written by sinks: json lines log (JsonLinesSink) or
+    Prometheus node_exporter textfile collector (PrometheusSink)
+"""
+import json
+import os
+import time
+from contextlib import contextmanager
+
+
+class ConversionMetrics(object):
+    def __init__(self, ftype, filename):
+        # ftype: file type ('ctd', 'mctd', 'cur' or 'bot'). filename: source file
+        self.ftype = ftype
+        self.filename = filename
+        self.status = None
+        self.ncfile = None
+        # duration of each stage (seconds). stages are kept in the order they were run
+        self.stages = {}
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.records = 0
+        self.read_method = None
+        # True if parsed header was read from the header cache
+        self.header_cached = False
+        self.error = None
+        self.error_message = None
+        self.start = time.time()
+
+    @contextmanager
+    def stage(self, name):
+        # time block of code as stage name. time is added if stage is run more than once
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.) + time.perf_counter() - start
+
+    def failure(self, e):
+        # record exception that stopped the conversion
+        self.error = type(e).__name__
+        self.error_message = str(e)
+
+    def from_obsfile(self, fdata):
+        # read counters kept by the file class (ObsFile). time spent decoding the data block is a separate stage
+        self.bytes_read = os.path.getsize(fdata.filename)
+        self.records = fdata.records_read
+        self.read_method = fdata.read_method
+        self.header_cached = fdata.header_cached
+        if fdata.read_time > 0:
+            self.stages['get_data'] = fdata.read_time
+
+    def finish(self, status, ncfile=None):
+        # set status of conversion and size of netcdf file
+        self.status = status
+        self.ncfile = ncfile
+        if ncfile is not None and os.path.exists(ncfile):
+            self.bytes_written = os.path.getsize(ncfile)
+        return self
+
+    def to_dict(self):
+        # returns metrics as a dictionary that can be returned by worker processes and serialized as json
+        return {'ftype': self.ftype, 'filename': self.filename, 'status': self.status, 'ncfile': self.ncfile,
+                'start': self.start, 'stages': self.stages, 'bytes_read': self.bytes_read,
+                'bytes_written': self.bytes_written, 'records': self.records, 'read_method': self.read_method,
+                'header_cached': self.header_cached, 'error': self.error, 'error_message': self.error_message}
+
+
+class JsonLinesSink(object):
+    # appends one json line for each file converted
+    def __init__(self, filename):
+        self.filename = filename
+
+    def write(self, records, elapsed=None):
+        # records: list of dictionaries (ConversionMetrics.to_dict). elapsed: total time of the batch (not used)
+        with open(self.filename, 'a') as fid:
+            for record in records:
+                fid.write(json.dumps(record) + '\n')
+
+
+class PrometheusSink(object):
+    # writes totals of the last batch in the Prometheus text format (for the node_exporter textfile collector)
+    # file is written to a temporary file and renamed so that the collector never reads a partial file
+    prefix = 'ios_conversion'
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def write(self, records, elapsed=None):
+        # records: list of dictionaries (ConversionMetrics.to_dict). elapsed: total time of the batch (seconds)
+        metrics = {}
+
+        def add(name, labels, value):
+            key = tuple(sorted(labels.items()))
+            metrics.setdefault(name, {})
+            metrics[name][key] = metrics[name].get(key, 0) + value
+
+        for r in records:
+            ftype = {'ftype': r['ftype']}
+            add('files', dict(ftype, status=r['status']), 1)
+            for stage, seconds in r['stages'].items():
+                add('stage_seconds', dict(ftype, stage=stage), seconds)
+            add('bytes_read', ftype, r['bytes_read'])
+            add('bytes_written', ftype, r['bytes_written'])
+            add('records', ftype, r['records'])
+            if r.get('header_cached'):
+                add('header_cache_hits', ftype, 1)
+            if r['read_method'] is not None:
+                add('read_method_files', dict(ftype, method=r['read_method']), 1)
+            if r['status'] != 'converted':
+                add('failures', dict(ftype, exception=r['error'] or 'none'), 1)
+        lines = []
+        for name, help_text in [('files', 'Number of files processed in the last run, by status'),
+                                ('stage_seconds', 'Time spent in each stage of the conversion in the last run'),
+                                ('bytes_read', 'Size of source files processed in the last run'),
+                                ('bytes_written', 'Size of netcdf files written in the last run'),
+                                ('records', 'Number of data records read in the last run'),
+                                ('header_cache_hits', 'Number of files with header read from the header cache'),
+                                ('read_method_files', 'Number of files read using each method (FORMAT, '
+                                                      'channel details or delimiter)'),
+                                ('failures', 'Number of files not converted in the last run, by exception type')]:
+            lines.append('# HELP {}_{} {}'.format(self.prefix, name, help_text))
+            lines.append('# TYPE {}_{} gauge'.format(self.prefix, name))
+            for key, value in metrics.get(name, {}).items():
+                lines.append('{}_{}{{{}}} {}'.format(self.prefix, name, format_labels(key), value))
+        types = sorted(set([r['ftype'] for r in records]))
+        lines.append('# HELP {}_last_run_timestamp_seconds Time the last run finished'.format(self.prefix))
+        lines.append('# TYPE {}_last_run_timestamp_seconds gauge'.format(self.prefix))
+        for ftype in types:
+            lines.append('{}_last_run_timestamp_seconds{{ftype="{}"}} {}'.format(self.prefix, ftype, time.time()))
+        if elapsed is not None:
+            lines.append('# HELP {}_run_seconds Total time of the last run'.format(self.prefix))
+            lines.append('# TYPE {}_run_seconds gauge'.format(self.prefix))
+            for ftype in types:
+                lines.append('{}_run_seconds{{ftype="{}"}} {}'.format(self.prefix, ftype, elapsed))
+        with open(self.filename + '.tmp', 'w') as fid:
+            fid.write('\n'.join(lines) + '\n')
+        os.replace(self.filename + '.tmp', self.filename)
+
+
+def format_labels(key):
+    # labels as name="value" pairs. quotes, backslash and new lines in values are escaped
+    return ','.join(['{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                     for k, v in key])
+
+
+def get_sinks(env_vars, ftype):
+    # sinks set in .env file
+    # metrics_jsonl: json lines file (appended). metrics_prom_folder: folder read by the textfile collector
+    # (file ios_conversion_<ftype>.prom is replaced after each run)
+    sinks = []
+    if env_vars.get('metrics_jsonl', '').strip() != '':
+        sinks.append(JsonLinesSink(env_vars['metrics_jsonl'].strip()))
+    if env_vars.get('metrics_prom_folder', '').strip() != '':
+        sinks.append(PrometheusSink(os.path.join(env_vars['metrics_prom_folder'].strip(),
+                                                 'ios_conversion_{}.prom'.format(ftype))))
+    return sinks
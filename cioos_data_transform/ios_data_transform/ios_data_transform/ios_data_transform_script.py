@@ -1,7 +1,8 @@
 import os
 import sys
 import glob
-from multiprocessing import Process
+import signal
+from multiprocessing import Pool, cpu_count, TimeoutError
 from time import time
 
 sys.path.insert(0, os.getcwd() + '/../../')
@@ -11,7 +12,7 @@ import subprocess
 
 def convert_files(env_vars, opt='all', ftype=None):
     # path of raw files, path for nc files, and option
-    # opt = 'new' for only new raw files
+    # opt = 'new' for only new or changed raw files (based on manifest of converted files)
     # opt = 'all' for all files. default value;
     # ftype =   'ctd' for CTD profiles
     #           'mctd' for mooring CTDs
@@ -29,6 +30,11 @@ def convert_files(env_vars, opt='all', ftype=None):
         flist = []
         flist.extend(glob.glob(in_path + '**/*.[Cc][Tt][Dd]', recursive=True))
         flist.extend(glob.glob(in_path + '**/*.mctd', recursive=True))
+    elif ftype == 'cur':
+        in_path = env_vars['cur_raw_folder']
+        out_path = env_vars['cur_nc_folder']
+        fgeo = env_vars['geojson_file']
+        flist = glob.glob(in_path + '**/*.[Cc][Uu][Rr]', recursive=True)
     elif ftype == 'bot':
         in_path = env_vars['bot_raw_folder']
         out_path = env_vars['bot_nc_folder']
@@ -40,83 +46,243 @@ def convert_files(env_vars, opt='all', ftype=None):
         print("ERROR: Filetype not understood ...")
         return None
     print("Total number of files =", len(flist))
-    # loop through files in list, read the data and write netcdf file if data read is successful
-    for i, fname in enumerate(flist[:]):
-        # print('\nProcessing -> {} {}'.format(i, fname))
-        p = Process(target=(convert_files_threads), args=(ftype, fname, fgeo, out_path))
-        p.start()
-        p.join()
+    # manifest keeps track of converted files. location can be set in .env
+    manifest = iod.ConversionManifest(os.path.join(env_vars.get('manifest_folder', '.'), ftype + '_manifest.sqlite'))
+    if opt == 'new':
+        todo = [fname for fname in flist if manifest.needs_conversion(fname)]
+    else:
+        todo = flist
+    print("Number of files to convert =", len(todo))
+    # read the data and write netcdf file if data read is successful. files are converted in a pool of workers
+    # number of workers, timeout for each file (seconds) and number of files submitted at a time can be set in .env
+    num_workers = int(env_vars.get('num_workers', cpu_count()))
+    file_timeout = int(env_vars.get('file_timeout', 600))
+    chunk_size = int(env_vars.get('chunk_size', 4 * num_workers))
+    # netcdf compression and chunking profile ('fast', 'balanced' or 'archive') for each file type
+    profile = env_vars.get(ftype + '_nc_profile', 'fast').strip()
+    # encoding of the original header in netcdf files ('attribute', 'compact' or 'variable', see OceanNcFile)
+    header_format = env_vars.get('header_format', 'attribute').strip()
+    # timing and counters of each file are written to the sinks set in .env (json lines and/or prometheus)
+    sinks = iod.instrumentation.get_sinks(env_vars, ftype)
+    # parsed headers are cached in header_cache_folder (if set in .env) so that files converted again are not parsed
+    # again. size of the cache (MB) is set by header_cache_max_mb
+    cache = None
+    if env_vars.get('header_cache_folder', '').strip() != '':
+        cache = iod.HeaderCache(env_vars['header_cache_folder'].strip(),
+                                int(env_vars.get('header_cache_max_mb', 256)) * 1024 * 1024)
+    summary = convert_batch(ftype, todo, fgeo, out_path, num_workers, file_timeout, chunk_size, manifest, profile,
+                            sinks, cache, header_format)
+    summary['skipped'].extend(compare_list(todo, flist))
+    print_summary(summary)
+    # remove netcdf files of source files that no longer exist
+    for ncfile in manifest.remove_missing(flist):
+        print('deleting file:', ncfile)
+        subprocess.call(['rm', '-f', ncfile])
+    manifest.close()
     return flist
 
 
-def convert_files_threads(ftype, fname, fgeo, out_path):
-    # skip processing file if its older than 24 hours old
-    if iod.file_mod_time(fname) < -24. and opt == 'new':
-        # print("Not converting file: ", fname)
-        return 0
+def compare_list(sub_set, global_set):
+    # return items in global_set that are not in sub_set
+    sub_set = set(sub_set)
+    return [i for i in global_set if i not in sub_set]
+
+
+def convert_batch(ftype, flist, fgeo, out_path, num_workers, file_timeout, chunk_size, manifest=None,
+                  profile='fast', sinks=None, cache=None, header_format='attribute'):
+    # convert list of files using a pool of worker processes
+    # each file runs in a worker process so that a crash does not stop the batch
+    # workers are replaced after a few files to release memory
+    # files are submitted in chunks. results are collected before the next chunk is submitted
+    # files converted successfully are recorded in manifest (if available)
+    # metrics of each file (see instrumentation.ConversionMetrics) are written to sinks after the batch
+    # returns dict with list of files for each status (converted, skipped, failed, timeout, crashed)
+    summary = {'converted': [], 'skipped': [], 'failed': [], 'timeout': [], 'crashed': []}
+    records = []
+    start = time()
+    pool = Pool(processes=num_workers, maxtasksperchild=50)
+    try:
+        for i in range(0, len(flist), chunk_size):
+            chunk = flist[i:i + chunk_size]
+            results = [(fname, pool.apply_async(convert_file_worker,
+                                                (ftype, fname, fgeo, out_path, file_timeout, profile, cache,
+                                                 header_format)))
+                       for fname in chunk]
+            # files time out in the worker. the deadline here catches workers that died while converting a file
+            deadline = time() + file_timeout * (len(chunk) // num_workers + 1) + 60
+            for fname, res in results:
+                try:
+                    status, ncfile, metrics, digest = res.get(timeout=max(deadline - time(), 1))
+                except TimeoutError:
+                    status, ncfile, digest = 'crashed', None, None
+                    metrics = iod.ConversionMetrics(ftype, fname).finish(status).to_dict()
+                summary[status].append(fname)
+                records.append(metrics)
+                if status == 'converted' and manifest is not None:
+                    manifest.record(fname, ncfile, digest)
+    finally:
+        pool.terminate()
+        pool.join()
+        for sink in sinks or []:
+            try:
+                sink.write(records, time() - start)
+            except Exception as e:
+                print("Error: Unable to write metrics:", sink.filename, e)
+    return summary
+
+
+def convert_file_worker(ftype, fname, fgeo, out_path, file_timeout, profile='fast', cache=None,
+                        header_format='attribute'):
+    # runs in worker process. converts a file and returns status of the conversion, netcdf file name,
+    # metrics of the conversion (as dictionary) and content hash of converted files (recorded in the manifest)
+    metrics = iod.ConversionMetrics(ftype, fname)
+    if file_timeout > 0 and hasattr(signal, 'SIGALRM'):
+        signal.signal(signal.SIGALRM, raise_timeout)
+        signal.alarm(file_timeout)
+    try:
+        status, ncfile = convert_files_threads(ftype, fname, fgeo, out_path, profile, metrics, cache,
+                                               header_format)
+    except FileTimeout as e:
+        print("Error: Timed out while converting file:", fname)
+        metrics.failure(e)
+        status, ncfile = 'timeout', None
+    except BaseException as e:
+        print("Error: Unable to convert file:", fname, e)
+        metrics.failure(e)
+        status, ncfile = 'failed', None
+    finally:
+        if file_timeout > 0 and hasattr(signal, 'SIGALRM'):
+            signal.alarm(0)
+    # source file is hashed here so that files are not hashed one at a time by the parent process
+    digest = iod.manifest.file_hash(fname) if status == 'converted' else None
+    return status, ncfile, metrics.finish(status, ncfile).to_dict(), digest
+
+
+class FileTimeout(Exception):
+    pass
+
+
+def raise_timeout(signum, frame):
+    raise FileTimeout()
+
+
+def print_summary(summary):
+    # print number of files with each status and the files that could not be converted
+    print("Summary: " + ", ".join(["{} {}".format(len(v), k) for k, v in summary.items()]))
+    for status in ['failed', 'timeout', 'crashed']:
+        for fname in summary[status]:
+            print("{}: {}".format(status, fname))
+
+
+def convert_files_threads(ftype, fname, fgeo, out_path, profile='fast', metrics=None, cache=None,
+                          header_format='attribute'):
+    # returns status of conversion ('converted' or 'failed') and name of netcdf file
+    # metrics: ConversionMetrics. time of each stage and counters are recorded if available
+    # cache: HeaderCache used to read (and save) parsed headers
+    # header_format: encoding of the original header in the netcdf file (see OceanNcFile.HEADER_FORMATS)
     print('Processing {} {}'.format(ftype, fname))
+    if metrics is None:
+        metrics = iod.ConversionMetrics(ftype, fname)
     # read file based on file type
-    if ftype == 'ctd':
-        fdata = iod.CtdFile(filename=fname, debug=False)
-    elif ftype == 'mctd':
-        fdata = iod.MCtdFile(filename=fname, debug=False)
-    elif ftype == 'bot':
-        fdata = iod.CtdFile(filename=fname, debug=False)
-    else:
-        print("Filetype not understood!")
-        sys.exit()
+    # files are memory-mapped. data is decoded when it is written (typed columns or chunks of records)
+    with metrics.stage('open'):
+        if ftype == 'ctd':
+            fdata = iod.CtdFile(filename=fname, debug=False, lazy=True, cache=cache)
+        elif ftype == 'mctd':
+            # data is read in chunks while the netcdf file is written (see write_mctd_ncfile)
+            fdata = iod.MCtdFile(filename=fname, debug=False, lazy=True, cache=cache)
+        elif ftype == 'cur':
+            # data is read in chunks while the netcdf file is written (see write_cur_ncfile)
+            fdata = iod.CurFile(filename=fname, debug=False, lazy=True, cache=cache)
+        elif ftype == 'bot':
+            fdata = iod.CtdFile(filename=fname, debug=False, lazy=True, cache=cache)
+        else:
+            print("Filetype not understood!")
+            sys.exit()
+    try:
+        return write_ncfile(ftype, fdata, fname, fgeo, out_path, profile, metrics, header_format)
+    finally:
+        # data is decoded while the file is written. time spent decoding is moved from 'write' to 'get_data'
+        metrics.from_obsfile(fdata)
+        if 'write' in metrics.stages:
+            metrics.stages['write'] = max(metrics.stages['write'] - fdata.read_time, 0.)
+        fdata.close()
+
+
+def write_ncfile(ftype, fdata, fname, fgeo, out_path, profile='fast', metrics=None, header_format='attribute'):
+    # import data and write netcdf file. returns status of conversion and name of netcdf file
     # if file class was created properly, try to import data
-    if fdata.import_data():
+    if metrics is None:
+        metrics = iod.ConversionMetrics(ftype, fname)
+    with metrics.stage('header'):
+        imported = fdata.import_data()
+    if imported:
         print("Imported data successfully!")
-        fdata.assign_geo_code(fgeo)
+        with metrics.stage('geo_code'):
+            fdata.assign_geo_code(fgeo)
         # now try to write the file...
         yy = fdata.start_date[0:4]
-        if not os.path.exists(out_path + yy):
-            os.mkdir(out_path + yy)
+        # folder may be created by another worker at the same time
+        os.makedirs(out_path + yy, exist_ok=True)
+        ncfile = out_path + yy + '/' + fname.split('/')[-1] + '.nc'
         if ftype == 'ctd':
             try:
-                iod.write_ctd_ncfile(out_path + yy + '/' + fname.split('/')[-1] + '.nc', fdata)
+                with metrics.stage('write'):
+                    iod.write_ctd_ncfile(ncfile, fdata, profile, header_format=header_format)
             except Exception as e:
                 print("Error: Unable to create netcdf file:", fname, e)
-                subprocess.call(['rm', '-f', out_path + yy + '/' + fname.split('/')[-1] + '.nc'])
+                metrics.failure(e)
+                subprocess.call(['rm', '-f', ncfile])
+                return 'failed', None
         elif ftype == 'mctd':
             try:
-                iod.write_mctd_ncfile(out_path + yy + '/' + fname.split('/')[-1] + '.nc', fdata)
+                with metrics.stage('write'):
+                    iod.write_mctd_ncfile(ncfile, fdata, profile, header_format=header_format)
             except Exception as e:
                 print("Error: Unable to create netcdf file:", fname, e)
-                subprocess.call(['rm', '-f', out_path + yy + '/' + fname.split('/')[-1] + '.nc'])
+                metrics.failure(e)
+                subprocess.call(['rm', '-f', ncfile])
+                return 'failed', None
+        elif ftype == 'cur':
+            try:
+                with metrics.stage('write'):
+                    iod.write_cur_ncfile(ncfile, fdata, profile, header_format=header_format)
+            except Exception as e:
+                print("Error: Unable to create netcdf file:", fname, e)
+                metrics.failure(e)
+                subprocess.call(['rm', '-f', ncfile])
+                return 'failed', None
         elif ftype == 'bot':
             try:
-                iod.write_ctd_ncfile(out_path + yy + '/' + fname.split('/')[-1] + '.nc', fdata)
+                with metrics.stage('write'):
+                    iod.write_ctd_ncfile(ncfile, fdata, profile, header_format=header_format)
             except Exception as e:
                 print("Error: Unable to create netcdf file:", fname, e)
-                subprocess.call(['rm', '-f', out_path + yy + '/' + fname.split('/')[-1] + '.nc'])
+                metrics.failure(e)
+                subprocess.call(['rm', '-f', ncfile])
+                return 'failed', None
+        return 'converted', ncfile
     else:
         print("Error: Unable to import data from file", fname)
-        return 0
+        return 'failed', None
 
 
 # read inputs if any from the command line
-# first input is 'all' or 'new' for processing all files or just files newer than 24 hours
+# first input is 'all' or 'new' for processing all files or just new/changed files since the last run
 # second input is file type and is one of ['ctd','mctd', 'cur', 'bot']
-if len(sys.argv) > 1:
-    opt = sys.argv[1].strip().lower()
-    ftype = sys.argv[2].strip().lower()
-else:  # default option. process all files !
-    opt = 'all'
-    ftype = 'ctd'
-env_vars = iod.import_env_variables('./.env')
-print('Inputs from .env file: ', env_vars)
-
-start = time()
-flist = convert_files(env_vars=env_vars, opt=opt, ftype=ftype)
-print("Time taken to convert files: {:0.2f}".format(time() - start))
-# if any raw files have been removed, delete corresponding netCDF files
-if flist is not None:
-    print("Checking if any netCDF files should be removed...")
-    ncfilelist = glob.glob(env_vars[ftype + '_nc_folder'] + '**/*.nc', recursive=True)
-    for i, e in enumerate(iod.utils.compare_file_list(sub_set=flist, global_set=ncfilelist)):
-        filename = glob.glob(env_vars[ftype + '_nc_folder'] + '**/{}.nc')
-        print('deleting file:', e)
-        subprocess.call(['rm', '-f', e])
-print("Total time taken:{:0.2f}".format(time() - start))
+# third (optional) input is number of worker processes. overrides num_workers in .env
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        opt = sys.argv[1].strip().lower()
+        ftype = sys.argv[2].strip().lower()
+    else:  # default option. process all files !
+        opt = 'all'
+        ftype = 'ctd'
+    env_vars = iod.import_env_variables('./.env')
+    if len(sys.argv) > 3:
+        env_vars['num_workers'] = sys.argv[3].strip()
+    print('Inputs from .env file: ', env_vars)
+
+    start = time()
+    flist = convert_files(env_vars=env_vars, opt=opt, ftype=ftype)
+    print("Total time taken:{:0.2f}".format(time() - start))
@@ -0,0 +1,71 @@
+"""
+    Parsing of dates in IOS headers (e.g. START TIME: UTC 2017/09/10 01:00:42.000)
+    Date strings start with a time zone followed by date and (optional) time. Zones are converted to UTC using a
+    table of fixed offsets (ZONE_OFFSETS). parse_date returns an aware datetime (UTC) and a datetime64
+    parse_dates converts a list of date strings (e.g. START TIME of many headers) to a datetime64 array
+"""
+import re
+from datetime import datetime, timedelta
+import numpy as np
+from pytz import timezone
+
+UTC = timezone('UTC')
+# hours added to local time to get UTC
+ZONE_OFFSETS = {
+    'UTC': 0, 'GMT': 0,
+    # Pacific
+    'PST': 8, 'PDT': 7,
+    # Canada/Mountain
+    'MST': 7, 'MDT': 6,
+    # Canada/Atlantic
+    'AST': 4, 'ADT': 3,
+}
+# zone, date (yyyy/mm/dd) and optional time (hh:mm[:ss[.ffffff]])
+DATE_PATTERN = re.compile(r'^\s*([A-Z]{3})\s+(\d{4})/(\d{1,2})/(\d{1,2})'
+                          r'(?:\s+(\d{1,2}):(\d{1,2})(?::(\d{1,2})(?:\.(\d*))?)?)?\s*$')
+
+
+def parse_date(date_string):
+    # returns date string (e.g. 'PDT 2017/09/10 01:00:42.000') as aware datetime (UTC) and datetime64 (us)
+    # raises Exception if the string or time zone can not be read
+    m = DATE_PATTERN.match(date_string.upper())
+    if m is None:
+        raise Exception('Unable to read date', date_string)
+    zone, year, month, day, hour, minute, second, fraction = m.groups()
+    if zone not in ZONE_OFFSETS:
+        raise Exception('Problem finding the timezone information->', date_string)
+    # time is added as timedelta so that times such as 24:00:00 are read
+    us = 0 if not fraction else int(round(float('0.' + fraction) * 1e6))
+    delta = timedelta(hours=int(hour or 0) + ZONE_OFFSETS[zone], minutes=int(minute or 0),
+                      seconds=int(second or 0), microseconds=us)
+    date_obj = datetime(int(year), int(month), int(day)) + delta
+    return UTC.localize(date_obj), np.datetime64(date_obj, 'us')
+
+
+def parse_dates(date_strings):
+    # returns list of date strings as datetime64 (us, UTC) array. strings that can not be read are NaT
+    # strings are converted by numpy (ISO format) and time zone offsets are applied to the whole array
+    # strings that numpy can not read (e.g. 24:00:00 or one digit months) are read using parse_date
+    strings = [s.strip().upper() for s in date_strings]
+    offsets = np.array([ZONE_OFFSETS.get(s[:3], 0) for s in strings], dtype='timedelta64[h]')
+    iso = [s[3:].strip().replace('/', '-').replace(' ', 'T') for s in strings]
+    try:
+        dates = np.array(iso, dtype='datetime64[us]')
+    except ValueError:
+        dates = np.empty(len(iso), dtype='datetime64[us]')
+        for i, s in enumerate(iso):
+            try:
+                dates[i] = np.datetime64(s, 'us')
+            except ValueError:
+                dates[i] = np.datetime64('NaT')
+    dates = dates + offsets
+    # zones that are not in the table and strings read by parse_date
+    for i, s in enumerate(strings):
+        if s[:3] not in ZONE_OFFSETS:
+            dates[i] = np.datetime64('NaT')
+        elif np.isnat(dates[i]):
+            try:
+                dates[i] = parse_date(s)[1]
+            except Exception:
+                pass
+    return dates
@@ -0,0 +1,72 @@
+"""
+    Persistent record of converted files (SQLite)
+    Keeps size, modification time, content hash, converter version and netcdf file name for each source file
+    so that repeated runs only convert new or changed files and only remove netcdf files whose source was removed
+"""
+import hashlib
+import os
+import sqlite3
+import time
+
+
+class ConversionManifest(object):
+    def __init__(self, filename, version=None):
+        # filename: sqlite database file. created if it does not exist
+        # version: converter version. files converted with a different version are converted again
+        if version is None:
+            from . import __version__ as version
+        self.version = version
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        self.db.execute('CREATE TABLE IF NOT EXISTS files (source TEXT PRIMARY KEY, size INTEGER, mtime REAL, '
+                        'hash TEXT, version TEXT, output TEXT, converted REAL)')
+        self.db.commit()
+
+    def needs_conversion(self, source):
+        # returns True if source file is new, has changed or was converted by a different version
+        # content hash is only calculated if size or modification time changed
+        row = self.db.execute('SELECT size, mtime, hash, version FROM files WHERE source = ?',
+                              (source,)).fetchone()
+        if row is None or row[3] != self.version:
+            return True
+        stat = os.stat(source)
+        if (stat.st_size, stat.st_mtime) == (row[0], row[1]):
+            return False
+        if stat.st_size == row[0] and file_hash(source) == row[2]:
+            # file was touched but content is the same
+            self.db.execute('UPDATE files SET mtime = ? WHERE source = ?', (stat.st_mtime, source))
+            self.db.commit()
+            return False
+        return True
+
+    def record(self, source, output, digest=None):
+        # record successful conversion of source file to output (netcdf) file
+        # digest: content hash of source (see file_hash). calculated here if not given
+        stat = os.stat(source)
+        if digest is None:
+            digest = file_hash(source)
+        self.db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (source, stat.st_size, stat.st_mtime, digest, self.version, output, time.time()))
+        self.db.commit()
+
+    def remove_missing(self, sources):
+        # remove entries for source files that are not in sources (i.e. have been deleted)
+        # returns list of output files of the removed entries
+        sources = set(sources)
+        rows = self.db.execute('SELECT source, output FROM files').fetchall()
+        missing = [row for row in rows if row[0] not in sources]
+        self.db.executemany('DELETE FROM files WHERE source = ?', [(row[0],) for row in missing])
+        self.db.commit()
+        return [row[1] for row in missing]
+
+    def close(self):
+        self.db.close()
+
+
+def file_hash(filename, blocksize=1 << 20):
+    # sha1 hash of file content
+    h = hashlib.sha1()
+    with open(filename, 'rb') as fid:
+        for block in iter(lambda: fid.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
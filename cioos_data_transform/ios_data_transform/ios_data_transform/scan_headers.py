@@ -0,0 +1,62 @@
+from .ObsFile import ObsFile
+
+
+def scan_headers(paths, debug=False):
+    '''
+    read key metadata from the header of IOS files without reading the data block
+    used to build catalogues of IOS archives before deciding which files to convert
+    inputs:
+        paths: list of IOS files
+        debug: debug state passed to ObsFile
+    output:
+        list of dictionaries (one per file) with filename, start_time, end_time, latitude, longitude,
+        mission, event_number, number_of_records and channels.
+        status is 1 if header was read successfully, 0 otherwise (error has the reason)
+    '''
+    info = []
+    for path in paths:
+        info.append(scan_header(path, debug))
+    return info
+
+
+def scan_header(path, debug=False):
+    # read metadata from the header of a single IOS file
+    # file is memory-mapped and only the header is decoded (see ObsFile lazy mode)
+    info = {'filename': path, 'start_time': None, 'end_time': None, 'latitude': None, 'longitude': None,
+            'mission': None, 'event_number': None, 'number_of_records': None, 'channels': None,
+            'status': 0, 'error': None}
+    try:
+        fdata = ObsFile(filename=path, debug=debug, lazy=True)
+    except SystemExit:
+        # ObsFile exits if the file can not be opened. record the failure and keep scanning
+        info['error'] = 'Unable to open file'
+        return info
+    try:
+        _, info['start_time'] = fdata.get_date(opt='start')
+        if 'END TIME' in fdata.file:
+            _, info['end_time'] = fdata.get_date(opt='end')
+        if 'NUMBER OF RECORDS' in fdata.file:
+            info['number_of_records'] = int(fdata.file['NUMBER OF RECORDS'])
+        location = fdata.get_location()
+        info['latitude'] = location['LATITUDE']
+        info['longitude'] = location['LONGITUDE']
+        if 'EVENT NUMBER' in location:
+            info['event_number'] = location['EVENT NUMBER'].strip()
+        administration = fdata.get_section('ADMINISTRATION')
+        if 'MISSION' in administration:
+            info['mission'] = administration['MISSION'].strip()
+        elif 'CRUISE' in administration:
+            info['mission'] = administration['CRUISE'].strip()
+        else:
+            deployment = fdata.get_section('DEPLOYMENT')
+            if 'MISSION' in deployment:
+                info['mission'] = deployment['MISSION'].strip()
+        info['channels'] = [name.strip() for name in fdata.get_channels()['Name']]
+        info['status'] = 1
+    except Exception as e:
+        print("Unable to read header of file", path)
+        print(e)
+        info['error'] = str(e)
+    finally:
+        fdata.close()
+    return info
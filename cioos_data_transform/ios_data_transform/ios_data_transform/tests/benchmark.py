@@ -0,0 +1,193 @@
+# script times and memory-profiles each stage of the IOS to netcdf conversion
+# stages: open (header read into memory), header (import_data, data block is not decoded), geo_code,
+#         get_data, build (OceanNcVar construction) and write_ncfile
+# mooring CTD and current meter files are streamed (data read in chunks while the file is written) as in
+# ios_data_transform_script.py. for these file types there is no get_data or build stage: write_ncfile includes
+# decoding the data block and OceanNcVar construction
+# files in test_files are also scaled up (data block repeated) to check how each stage grows with file length
+# results are written as json lines (one line per file, scale and stage) to compare runs across releases
+#
+# usage (from the tests folder):
+#   python benchmark.py [--scale 1 10 100] [--repeat 3] [--output results.jsonl] [--baseline old.jsonl]
+import sys
+import os
+import io
+import re
+import json
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import contextlib
+from glob import glob
+from time import perf_counter, strftime
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+import ios_data_transform as iod
+from ios_data_transform.write_ctd_ncfile import build_ctd_ncfile
+
+TEST_FILES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_files')
+GEOJSON = os.path.join(TEST_FILES, 'ios_polygons.geojson')
+# file class and writer for each file family in test_files
+# writer is None if the file is written using build_ctd_ncfile and OceanNcFile.write_ncfile
+FAMILIES = {
+    'ctd_profile': (iod.CtdFile, None),
+    'bot': (iod.BotFile, None),
+    'ctd_mooring': (iod.MCtdFile, iod.write_mctd_ncfile),
+    'current_meter': (iod.CurFile, iod.write_cur_ncfile),
+}
+STAGES = ['open', 'header', 'geo_code', 'get_data', 'build', 'write_ncfile']
+# stages faster than this (seconds) are not compared to the baseline. timing of short stages is mostly noise
+MIN_SECONDS = 0.01
+
+
+def scale_file(filename, scale, out_path):
+    # create copy of file with data block repeated scale times. NUMBER OF RECORDS in header is updated
+    # returns name of the new file
+    with open(filename, 'rb') as fid:
+        raw = fid.read()
+    idx = raw.find(b'\n*END OF HEADER')
+    idx = raw.find(b'\n', idx + 1) + 1
+    header, block = raw[:idx], raw[idx:]
+    # only records in the data block are repeated (ignore blank lines at the end of the file)
+    block = block.rstrip(b'\r\n ') + b'\n'
+    nrec = len(block.splitlines())
+    header = re.sub(rb'(NUMBER OF RECORDS\s*:\s*)\d+', lambda m: m.group(1) + str(nrec * scale).encode(),
+                    header, count=1)
+    scaled = os.path.join(out_path, 'x{}_'.format(scale) + os.path.basename(filename))
+    with open(scaled, 'wb') as fid:
+        fid.write(header + block * scale)
+    return scaled
+
+
+def run_stage(stage, func, result):
+    # time func and record peak memory allocated (python and numpy) while it runs
+    # output printed by the package is not shown. returns value returned by func
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    start = perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        value = func()
+    result[stage] = {'seconds': perf_counter() - start,
+                     'peak_bytes': tracemalloc.get_traced_memory()[1] - before}
+    return value
+
+
+def convert_file(filename, family, ncfile):
+    # convert one file and return timing and memory used by each stage
+    fcls, writer = FAMILIES[family]
+    result = {}
+    fdata = run_stage('open', lambda: fcls(filename=filename, debug=False, lazy=True), result)
+    try:
+        if not run_stage('header', fdata.import_data, result):
+            raise Exception('Unable to import data from file: {}'.format(filename))
+        run_stage('geo_code', lambda: fdata.assign_geo_code(GEOJSON), result)
+        if writer is None:
+            # data is decoded here and kept in fdata.data (build_ctd_ncfile uses it)
+            run_stage('get_data', lambda: setattr(fdata, 'data', fdata.read_data()), result)
+            out = run_stage('build', lambda: build_ctd_ncfile(fdata), result)
+            run_stage('write_ncfile', lambda: out.write_ncfile(ncfile), result)
+        else:
+            # data block is decoded in chunks by the writer (lazy mode, see ObsFile.iter_data)
+            run_stage('write_ncfile', lambda: writer(ncfile, fdata), result)
+        nrec = int(fdata.file['NUMBER OF RECORDS'])
+    finally:
+        fdata.close()
+    return nrec, result
+
+
+def benchmark(scales, repeat, out_path):
+    # returns list of results (dict) for each file, scale and stage
+    # time is the fastest of repeat runs. memory is the peak of the fastest run
+    info = {'version': iod.__version__, 'date': strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine()}
+    results = []
+    tracemalloc.start()
+    for family in FAMILIES:
+        for fn in sorted(glob(os.path.join(TEST_FILES, family, '*.*'))):
+            for scale in scales:
+                fname = fn if scale == 1 else scale_file(fn, scale, out_path)
+                runs = []
+                for i in range(repeat):
+                    try:
+                        runs.append(convert_file(fname, family, os.path.join(out_path, 'benchmark.nc')))
+                    except Exception as e:
+                        print('Error: unable to convert file:', fname, e)
+                        break
+                if len(runs) == 0:
+                    continue
+                nrec = runs[0][0]
+                for stage in STAGES:
+                    times = [r[stage] for _, r in runs if stage in r]
+                    if len(times) == 0:
+                        continue
+                    best = min(times, key=lambda r: r['seconds'])
+                    results.append(dict(info, family=family, file=os.path.basename(fn), scale=scale,
+                                        bytes=os.path.getsize(fname), records=nrec, stage=stage,
+                                        seconds=best['seconds'], peak_bytes=best['peak_bytes'],
+                                        mean_seconds=sum([r['seconds'] for r in times]) / len(times)))
+                if fname != fn:
+                    os.remove(fname)
+    tracemalloc.stop()
+    return results
+
+
+def compare(results, baseline, threshold):
+    # print stages that are slower (or use more memory) than in baseline by more than threshold (ratio)
+    # results are matched using family, file, scale and stage. latest result in baseline is used if it has many runs
+    def key(r):
+        return r['family'], r['file'], r['scale'], r['stage']
+    old = {key(r): r for r in baseline}
+    count = 0
+    for r in results:
+        if key(r) not in old:
+            continue
+        for field in ['seconds', 'peak_bytes']:
+            if field == 'seconds' and old[key(r)][field] < MIN_SECONDS:
+                continue
+            if old[key(r)][field] > 0 and r[field] / old[key(r)][field] > threshold:
+                count = count + 1
+                print('Regression: {} {} x{} {} {}: {:.4g} -> {:.4g}'.format(*key(r), field, old[key(r)][field],
+                                                                           r[field]))
+    print('Number of regressions:', count)
+    return count
+
+
+def print_summary(results):
+    # total time and largest peak memory of each stage for each family and scale
+    summary = {}
+    for r in results:
+        buf = summary.setdefault((r['family'], r['scale'], r['stage']), [0., 0])
+        buf[0] = buf[0] + r['seconds']
+        buf[1] = max(buf[1], r['peak_bytes'])
+    print('{:15s}{:>7s} {:14s}{:>10s}{:>12s}'.format('family', 'scale', 'stage', 'seconds', 'peak (KB)'))
+    for (family, scale, stage), (seconds, peak) in summary.items():
+        print('{:15s}{:>7d} {:14s}{:>10.3f}{:>12d}'.format(family, scale, stage, seconds, peak // 1024))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark conversion of IOS files to netcdf')
+    parser.add_argument('--scale', type=int, nargs='+', default=[1, 10],
+                        help='number of times the data block of each test file is repeated')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs for each file')
+    parser.add_argument('--output', default=None, help='json lines file. results are appended')
+    parser.add_argument('--baseline', default=None, help='json lines file with results of an earlier run')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='ratio to baseline above which a stage is reported as a regression')
+    args = parser.parse_args()
+
+    temp_path = tempfile.mkdtemp(prefix='ios_benchmark_')
+    try:
+        results = benchmark(args.scale, args.repeat, temp_path)
+    finally:
+        shutil.rmtree(temp_path)
+    print_summary(results)
+    if args.output is not None:
+        with open(args.output, 'a') as fid:
+            for r in results:
+                fid.write(json.dumps(r) + '\n')
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as fid:
+            baseline = [json.loads(line) for line in fid if line.strip() != '']
+        sys.exit(1 if compare(results, baseline, args.threshold) > 0 else 0)
@@ -4,6 +4,11 @@ import os
 sys.path.insert(0, os.getcwd()+'/../../')
 import ios_data_transform as iod
 from glob import glob
+import shutil
+import tempfile
+import json
+import numpy as np
+from shapely.geometry import Point
 
 
 def fix_path(path):
@@ -15,16 +20,27 @@ def fix_path(path):
 
 
 def convert_mctd_files(f, out_path):
-    fdata = iod.MCtdFile(filename=f, debug=False)
+    fdata = iod.MCtdFile(filename=f, debug=False, lazy=True)
     if fdata.import_data():
         fdata.assign_geo_code(fix_path('test_files/ios_polygons.geojson'))
         iod.write_mctd_ncfile(fix_path(out_path+f.split(os.path.sep)[-1]+'.nc'), fdata)
     else:
         print("Unable to import data from file", fdata.filename)
+    fdata.close()
 
 
-def convert_bot_files(f, out_path):
-    fdata = iod.BotFile(filename=f, debug=False)
+def convert_cur_files(f, out_path):
+    fdata = iod.CurFile(filename=f, debug=False, lazy=True)
+    if fdata.import_data():
+        fdata.assign_geo_code(fix_path('test_files/ios_polygons.geojson'))
+        iod.write_cur_ncfile(fix_path(out_path+f.split(os.path.sep)[-1]+'.nc'), fdata)
+    else:
+        print("Unable to import data from file", fdata.filename)
+    fdata.close()
+
+
+def convert_bot_files(f, out_path, cache=None):
+    fdata = iod.BotFile(filename=f, debug=False, cache=cache)
     print(fdata.filename)
     if fdata.import_data():
         # print(fdata.data)
@@ -35,7 +51,7 @@ def convert_bot_files(f, out_path):
 
 
 def convert_ctd_files(f, out_path):
-    fdata = iod.CtdFile(filename=f, debug=False)
+    fdata = iod.CtdFile(filename=f, debug=False, lazy=True)
     print(fdata.filename)
     if fdata.import_data():
         # print(fdata.data)
@@ -43,15 +59,204 @@ def convert_ctd_files(f, out_path):
         iod.write_ctd_ncfile(fix_path(out_path+f.split(os.path.sep)[-1]+'.nc'), fdata)
     else:
         print("Unable to import data from file", fdata.filename)
+    fdata.close()
 
 
 for fn in glob(fix_path('./test_files/ctd_mooring/*.*'), recursive=True):
     convert_mctd_files(f=fn, out_path=fix_path('./temp/'))
 
+# data read by import_data (not lazy) is written in chunks without reading the data block again
+out_folder = tempfile.mkdtemp(prefix='ios_chunks_')
+fdata = iod.MCtdFile(filename=sorted(glob(fix_path('./test_files/ctd_mooring/*.*')))[0], debug=False)
+if fdata.import_data():
+    fdata.assign_geo_code(fix_path('test_files/ios_polygons.geojson'))
+    iod.write_mctd_ncfile(os.path.join(out_folder, 'mctd.nc'), fdata, chunk_size=1000)
+    assert fdata.records_read == int(fdata.file['NUMBER OF RECORDS'])
+shutil.rmtree(out_folder)
+
+for fn in glob(fix_path('./test_files/current_meter/*.*'), recursive=True):
+    convert_cur_files(f=fn, out_path=fix_path('./temp/'))
+
+# current meter data read by import_data (not lazy) is not read again by the writer
+out_folder = tempfile.mkdtemp(prefix='ios_chunks_')
+fdata = iod.CurFile(filename=sorted(glob(fix_path('./test_files/current_meter/*.*')))[0], debug=False)
+if fdata.import_data():
+    fdata.assign_geo_code(fix_path('test_files/ios_polygons.geojson'))
+    iod.write_cur_ncfile(os.path.join(out_folder, 'cur.nc'), fdata, chunk_size=1000)
+    assert fdata.records_read == int(fdata.file['NUMBER OF RECORDS'])
+shutil.rmtree(out_folder)
+
 for fn in glob(fix_path('./test_files/ctd_profile/*.*'), recursive=True):
     convert_ctd_files(f=fn, out_path=fix_path('./temp/'))
 
+# profiles have no date and time channels. time of each record is the start time
+for fn in glob(fix_path('./test_files/ctd_profile/*.*'), recursive=True):
+    fdata = iod.CtdFile(filename=fn, debug=False, lazy=True)
+    if fdata.import_data():
+        record_time = fdata.get_record_time()
+        assert len(record_time) == int(fdata.file['NUMBER OF RECORDS'])
+        assert (record_time == np.datetime64(fdata.start_dateobj.replace(tzinfo=None), 'ms')).all()
+    fdata.close()
+
+# parsed headers of bottle files are cached. headers are read from the cache when the files are aggregated
+header_cache = iod.HeaderCache(tempfile.mkdtemp(prefix='ios_header_cache_'))
 for fn in glob(fix_path('./test_files/bot/*.*'), recursive=True):
-    convert_bot_files(f=fn, out_path=fix_path('./temp/'))
+    convert_bot_files(f=fn, out_path=fix_path('./temp/'), cache=header_cache)
+
+# aggregate bottle profiles into one file per cruise (contiguous ragged array)
+bot_files = []
+for fn in glob(fix_path('./test_files/bot/*.*'), recursive=True):
+    fdata = iod.BotFile(filename=fn, debug=False, cache=header_cache)
+    if fdata.import_data():
+        fdata.assign_geo_code(fix_path('test_files/ios_polygons.geojson'))
+        bot_files.append(fdata)
+for cruise, flist in iod.group_ctd_files(bot_files, by='cruise').items():
+    iod.write_ctd_ragged_ncfile(fix_path('./temp/{}_bot_profiles.nc'.format(cruise)), flist)
+print('Headers read from cache:', sum([fdata.header_cached for fdata in bot_files]), 'of', len(bot_files))
+shutil.rmtree(header_cache.folder)
+
+# convert bottle files in parallel (as ios_data_transform_script.py does) into an empty output folder
+# all files have the same year. workers create the folder of the year at the same time
+from ios_data_transform.ios_data_transform_script import convert_batch
+out_folder = tempfile.mkdtemp(prefix='ios_batch_')
+flist = sorted(glob(fix_path('./test_files/bot/*.*')))
+summary = convert_batch('bot', flist, fix_path('test_files/ios_polygons.geojson'), out_folder + '/', num_workers=4,
+                        file_timeout=60, chunk_size=len(flist))
+assert sorted(summary['converted']) == flist, summary
+shutil.rmtree(out_folder)
+
+# header scan: metadata is read from the header only and matches the full import. missing files are reported
+flist = sorted(glob(fix_path('./test_files/ctd_profile/*.*')))
+info = iod.scan_headers(flist + [fix_path('./test_files/missing.ctd')])
+assert [i['status'] for i in info] == [1] * len(flist) + [0]
+assert info[-1]['error'] is not None
+for i in info[:-1]:
+    fdata = iod.CtdFile(filename=i['filename'], debug=False, lazy=True)
+    fdata.import_data()
+    assert i['start_time'] == fdata.start_date
+    assert i['number_of_records'] == int(fdata.file['NUMBER OF RECORDS'])
+    assert (i['latitude'], i['longitude']) == (fdata.location['LATITUDE'], fdata.location['LONGITUDE'])
+    assert i['channels'] == [name.strip() for name in fdata.channels['Name']]
+    fdata.close()
+
+# manifest of converted files: unchanged or touched files are skipped, changed files are converted again and
+# outputs of deleted sources are returned by remove_missing
+manifest_folder = tempfile.mkdtemp(prefix='ios_manifest_')
+source = os.path.join(manifest_folder, 'test.ctd')
+shutil.copy(sorted(glob(fix_path('./test_files/ctd_profile/*.*')))[0], source)
+manifest = iod.ConversionManifest(os.path.join(manifest_folder, 'manifest.sqlite'), version='test')
+assert manifest.needs_conversion(source)
+manifest.record(source, 'test.ctd.nc')
+assert manifest.needs_conversion(source) is False
+stat = os.stat(source)
+os.utime(source, (stat.st_atime + 10, stat.st_mtime + 10))
+assert manifest.needs_conversion(source) is False
+with open(source, 'a') as fid:
+    fid.write('\n')
+assert manifest.needs_conversion(source)
+manifest.record(source, 'test.ctd.nc', iod.manifest.file_hash(source))
+other = iod.ConversionManifest(manifest.filename, version='other')
+assert other.needs_conversion(source)
+other.close()
+assert manifest.remove_missing([source]) == []
+assert manifest.remove_missing([]) == ['test.ctd.nc']
+assert manifest.needs_conversion(source)
+manifest.close()
+shutil.rmtree(manifest_folder)
+
+# geographic areas found using the spatial index are the same as those found by checking every polygon
+geojson = fix_path('test_files/ios_polygons.geojson')
+polygons = iod.read_geojson(geojson)
+bounds = np.array([p.bounds for p in polygons.values()])
+lons, lats = np.meshgrid(np.linspace(bounds[:, 0].min() - 1, bounds[:, 2].max() + 1, 40),
+                         np.linspace(bounds[:, 1].min() - 1, bounds[:, 3].max() + 1, 40))
+areas = iod.find_geographic_areas(geojson, lons.ravel(), lats.ravel())
+assert any([a != '' for a in areas])
+for lon, lat, area in zip(lons.ravel(), lats.ravel(), areas):
+    assert area == iod.find_geographic_area(polygons, Point(lon, lat))
+    assert area == iod.utils.load_geo_index(geojson).find(Point(lon, lat))
+
+# conversion metrics are written to a json lines log and a prometheus textfile
+metrics_folder = tempfile.mkdtemp(prefix='ios_metrics_')
+records = []
+for fn in sorted(glob(fix_path('./test_files/ctd_profile/*.*')))[:2]:
+    metrics = iod.ConversionMetrics('ctd', fn)
+    fdata = iod.CtdFile(filename=fn, debug=False, lazy=True)
+    with metrics.stage('header'):
+        fdata.import_data()
+    fdata.get_column(0)
+    metrics.from_obsfile(fdata)
+    fdata.close()
+    records.append(metrics.finish('converted').to_dict())
+metrics = iod.ConversionMetrics('ctd', 'missing.ctd')
+metrics.failure(ValueError('bad "file"'))
+records.append(metrics.finish('failed').to_dict())
+iod.JsonLinesSink(os.path.join(metrics_folder, 'metrics.jsonl')).write(records, 1.)
+with open(os.path.join(metrics_folder, 'metrics.jsonl')) as fid:
+    assert [json.loads(line) for line in fid] == records
+assert records[0]['records'] == int(iod.CtdFile(filename=records[0]['filename'], debug=False).file['NUMBER OF RECORDS'])
+assert 'header' in records[0]['stages'] and 'get_data' in records[0]['stages']
+iod.PrometheusSink(os.path.join(metrics_folder, 'ios_conversion_ctd.prom')).write(records, 1.)
+assert sorted(os.listdir(metrics_folder)) == ['ios_conversion_ctd.prom', 'metrics.jsonl']
+with open(os.path.join(metrics_folder, 'ios_conversion_ctd.prom')) as fid:
+    prom = fid.read().splitlines()
+assert 'ios_conversion_files{ftype="ctd",status="converted"} 2' in prom
+assert 'ios_conversion_failures{exception="ValueError",ftype="ctd"} 1' in prom
+assert iod.instrumentation.format_labels([('error', 'bad "file"')]) == 'error="bad \\"file\\""'
+shutil.rmtree(metrics_folder)
+
+# header tables are split using the dash line. comment and blank rows are skipped, blank cells are kept
+fdata = iod.CtdFile(filename=sorted(glob(fix_path('./test_files/ctd_profile/*.*')))[0], debug=False)
+row = '     {:<2} {:<8} {:<7} {:<7} {:<10} {:<4}'
+table_lines = ['    !No Name     Units   Minimum Date       Pad',
+               '    !-- -------- ------- ------- ---------- ----',
+               row.format('1', 'Pressure', 'decibar', '1.5', '2017/09/10', '-99'),
+               '    ! comment row',
+               '',
+               row.format('2', 'Temp', "'deg C'", '?', '2017/09/11', ''),
+               row.format('3', '', 'PSS-78', '30.1', '', '')]
+names, columns = fdata.split_table(table_lines)
+assert names == ['No', 'Name', 'Units', 'Minimum', 'Date', 'Pad']
+assert all([len(column) == 3 for column in columns])
+assert columns[1][0] == 'Pressure' and columns[5][1] == '    '
+table = fdata.parse_table(table_lines)
+assert table['Name'] == ['Pressure', 'Temp', ''] and table['Units'] == ['decibar', "'deg C'", 'PSS-78']
+assert table['Minimum'] == ['1.5', '?', '30.1'] and table['Pad'] == ['-99', '', '']
+names, columns = fdata.split_table(['    !---- ---', '     a    b', '     c    d extra'])
+assert names == ['Column1', 'Column2'] and columns == [['a   ', 'c   '], ['b  ', 'd extra']]
+
+# header tables are typed by column and kept after the first read
+columns = {key: iod.fixed_width.typed_table_column(column, key) for key, column in zip(*fdata.split_table(table_lines))}
+assert columns['No'].dtype == np.int64 and list(columns['No']) == [1, 2, 3]
+assert list(columns['Units']) == ['decibar', 'deg C', 'PSS-78']
+assert columns['Minimum'][0] == 1.5 and np.isnan(columns['Minimum'][1])
+assert columns['Date'].dtype == np.dtype('datetime64[D]') and np.isnat(columns['Date'][2])
+assert columns['Pad'][0] == -99. and np.all(np.isnan(columns['Pad'][1:]))
+programs = fdata.get_table('HISTORY', 'PROGRAMS')
+assert programs['Name'].dtype.kind == 'U' and programs['Vers'].dtype.kind == 'U'
+assert programs['Date'].dtype == np.dtype('datetime64[D]')
+assert programs['Time'].dtype == np.dtype('timedelta64[s]')
+assert np.all(programs['Time'] < np.timedelta64(1, 'D'))
+assert programs['Recs In'].dtype == np.float64 and np.isnan(programs['Recs In'][-1])
+assert fdata.get_table('*HISTORY', '$TABLE: PROGRAMS') is programs
+assert fdata.get_table('HISTORY', 'NOT A TABLE') is None
+
+# header dates are converted to UTC using the zone offset. malformed dates raise (parse_date) or are NaT (parse_dates)
+assert iod.parse_date('PST 2017/01/10 16:30')[1] == np.datetime64('2017-01-11T00:30')
+assert iod.parse_date('PDT 2017/09/09 18:00:42')[0] == iod.parse_date('UTC 2017/09/10 01:00:42.000')[0]
+assert iod.parse_date('pdt 2017/9/9 24:00:00.5')[1] == np.datetime64('2017-09-10T07:00:00.5')
+assert iod.parse_date('MST 2017/09/10')[0].utcoffset().total_seconds() == 0
+for date_string in ['XYZ 2017/09/10', 'UTC 2017-09-10', 'UTC 2017/09/10 1:00 PM', '']:
+    try:
+        iod.parse_date(date_string)
+    except Exception:
+        continue
+    raise AssertionError(date_string)
+dates = iod.parse_dates(['UTC 2017/09/10 01:00:42.000', 'PDT 2017/09/09 18:00:42', 'MST 2017/09/10',
+                         'PDT 2017/09/09 24:00:00', 'AST 2017/09/10 04:00', 'XYZ 2017/09/10 01:00', 'UTC not a date'])
+assert dates.dtype == np.dtype('datetime64[us]')
+assert list(dates[:5]) == [np.datetime64('2017-09-10T01:00:42', 'us')] * 2 + [np.datetime64('2017-09-10T07:00', 'us')] * 2 + \
+    [np.datetime64('2017-09-10T08:00', 'us')]
+assert np.all(np.isnat(dates[5:]))
 
 # print(iod.utils.compare_file_list(['a.bot', 'c.bkas.asd'], ['a.nc', 'b.nc', 'c.nc', 'd.nc']))
@@ -1,4 +1,8 @@
 from shapely.geometry import Polygon, Point
+from shapely.strtree import STRtree
+from functools import lru_cache
+import numpy as np
+import shapely
 import json
 import os
 
@@ -81,6 +85,52 @@ def find_geographic_area(poly_dict, point):
     return name_str
 
 
+class GeoIndex(object):
+    """
+    Polygons from a geojson file with a spatial index (STRtree) and prepared geometries
+    Used to find the geographic area(s) that contain a point, or many points at once
+    Names are returned in the same order and format as find_geographic_area
+    """
+    def __init__(self, poly_dict):
+        self.names = [key.replace(' ', '-') for key in poly_dict]
+        self.polygons = list(poly_dict.values())
+        for p in self.polygons:
+            shapely.prepare(p)
+        self.tree = STRtree(self.polygons)
+
+    def find(self, point):
+        # return names of all polygons that contain point (shapely Point)
+        return self.find_xy([point.x], [point.y])[0]
+
+    def find_xy(self, lons, lats):
+        # return list with names of the polygons containing each point (lon, lat)
+        points = shapely.points(np.asarray(lons, dtype=float), np.asarray(lats, dtype=float))
+        # pairs of (point index, polygon index) where polygon contains point
+        hits = self.tree.query(points, predicate='within')
+        names = [''] * len(points)
+        for ipt, ipoly in sorted(zip(hits[0], hits[1])):
+            names[ipt] = '{}{} '.format(names[ipt], self.names[ipoly])
+        return names
+
+
+@lru_cache(maxsize=8)
+def load_geo_index(filename):
+    # read geojson file and build spatial index once per process
+    return GeoIndex(read_geojson(filename))
+
+
+def find_geographic_areas(filename, lons, lats):
+    # batch version of find_geographic_area. returns names of polygons (in geojson file) that contain each point
+    # inputs are geojson file and arrays of longitudes and latitudes
+    return load_geo_index(filename).find_xy(lons, lats)
+
+
+def column_source(obsfile, i):
+    # data source (see OceanNcVar.get_chunk) for channel i of each chunk of data read from obsfile
+    # column is converted to the type of the channel (see ObsFile.to_typed_column)
+    return lambda start, block: obsfile.to_typed_column(block, i)
+
+
 def compare_file_list(sub_set, global_set, opt='not-in'):
     from itertools import compress
     # compares files in sub_set and global_set to find strings from global_set that are 'not-in' or 'in' sub_set
@@ -1,24 +1,40 @@
-# import random
-import json
 from .OceanNcFile import CtdNcFile
 from .OceanNcVar import OceanNcVar
-from .utils import is_in, release_memory, find_geographic_area, read_geojson
-from datetime import datetime
-from netCDF4 import Dataset as ncdata
-from shapely.geometry import Point
+from .channel_table import classify_channel, NcVarList
 
 
-def write_ctd_ncfile(filename, ctdcls):
+def write_ctd_ncfile(filename, ctdcls, profile='fast', header_format='attribute'):
     '''
     use data and methods in ctdcls object to write the CTD data into a netcdf file
     author: Pramod Thupaki pramod.thupaki@hakai.org
     inputs:
         filename: output file name to be created in netcdf format
         ctdcls: ctd object. includes methods to read IOS format and stores data
+        profile: netcdf write profile ('fast', 'balanced' or 'archive'). sets compression and chunking
+        header_format: encoding of the original header (see OceanNcFile.HEADER_FORMATS)
     output:
         NONE
     '''
+    out = build_ctd_ncfile(ctdcls, profile, header_format)
+    out.write_ncfile(filename)
+    print("Finished writing file:", filename, "\n")
+    # release_memory(out)
+    return 1
+
+
+def build_ctd_ncfile(ctdcls, profile='fast', header_format='attribute'):
+    '''
+    create CtdNcFile object (global attributes and list of variables) from the CTD data in ctdcls
+    used by write_ctd_ncfile and by the aggregation writer (write_ctd_ragged_ncfile)
+    inputs:
+        ctdcls: ctd object. includes methods to read IOS format and stores data
+        profile: netcdf write profile ('fast', 'balanced' or 'archive'). sets compression and chunking
+        header_format: encoding of the original header (see OceanNcFile.HEADER_FORMATS)
+    output:
+        CtdNcFile object ready to be written using write_ncfile
+    '''
     out = CtdNcFile()
+    out.profile = profile
     # write global attributes
     out.featureType = 'profile'
     if ctdcls.type == 'ctd':
@@ -33,11 +49,12 @@ def write_ctd_ncfile(filename, ctdcls):
     out.infoUrl = 'http://www.pac.dfo-mpo.gc.ca/science/oceans/data-donnees/index-eng.html'
     out.cdm_profile_variables = 'time'  # TEMPS901, TEMPS902, TEMPS601, TEMPS602, TEMPS01, PSALST01, PSALST02, PSALSTPPT01, PRESPR01
     # write full original header, as json dictionary
-    out.HEADER = json.dumps(ctdcls.get_complete_header(), ensure_ascii=False, indent=False)
+    out.header_format = header_format
+    out.HEADER = ctdcls.get_header_json(compact=header_format != 'attribute')
     # initcreate dimension variable
     out.nrec = int(ctdcls.file['NUMBER OF RECORDS'])
     # add variable profile_id (dummy variable)
-    ncfile_var_list = []
+    ncfile_var_list = NcVarList()
     ncfile_var_list.append(OceanNcVar('str_id', 'filename', None, None, None, ctdcls.filename.split('/')[-1]))
     # add administration variables
     if 'COUNTRY' in ctdcls.administration:
@@ -99,53 +116,23 @@ def write_ctd_ncfile(filename, ctdcls):
             else:
                 print("Channel Details missing. Setting Pad value to ' ' ...")
                 null_value = "' '"
-        if is_in(['depth'], channel) and not is_in(['nominal'], channel):
-            ncfile_var_list.append(OceanNcVar('depth', 'depth',
-                                              ctdcls.channels['Units'][i], ctdcls.channels['Minimum'][i],
-                                              ctdcls.channels['Maximum'][i], ctdcls.data[:, i], ncfile_var_list, ('z'),
-                                              null_value))
-        elif is_in(['pressure'], channel):
-            ncfile_var_list.append(OceanNcVar('pressure', 'pressure',
-                                              ctdcls.channels['Units'][i], ctdcls.channels['Minimum'][i],
-                                              ctdcls.channels['Maximum'][i], ctdcls.data[:, i], ncfile_var_list, ('z'),
-                                              null_value))
-        elif is_in(['temperature'], channel) and not is_in(['flag', 'rinko', 'bottle'], channel):
-            ncfile_var_list.append(OceanNcVar('temperature', ctdcls.channels['Name'][i],
-                                              ctdcls.channels['Units'][i], ctdcls.channels['Minimum'][i],
-                                              ctdcls.channels['Maximum'][i], ctdcls.data[:, i], ncfile_var_list, ('z'),
-                                              null_value))
-        elif is_in(['salinity'], channel) and not is_in(['flag'], channel):
-            ncfile_var_list.append(OceanNcVar('salinity', ctdcls.channels['Name'][i],
-                                              ctdcls.channels['Units'][i], ctdcls.channels['Minimum'][i],
-                                              ctdcls.channels['Maximum'][i], ctdcls.data[:, i], ncfile_var_list, ('z'),
-                                              null_value))
-        elif is_in(['oxygen'], channel) and not is_in(
-                ['flag', 'bottle', 'rinko', 'temperature', 'current', 'isotope', 'saturation'], channel):
-            ncfile_var_list.append(OceanNcVar('oxygen', ctdcls.channels['Name'][i],
-                                              ctdcls.channels['Units'][i], ctdcls.channels['Minimum'][i],
-                                              ctdcls.channels['Maximum'][i], ctdcls.data[:, i], ncfile_var_list, ('z'),
-                                              null_value))
-        elif is_in(['conductivity'], channel):
-            ncfile_var_list.append(OceanNcVar('conductivity', ctdcls.channels['Name'][i],
-                                              ctdcls.channels['Units'][i], ctdcls.channels['Minimum'][i],
-                                              ctdcls.channels['Maximum'][i], ctdcls.data[:, i], ncfile_var_list, ('z'),
-                                              null_value))
-        #     Nutrients in bottle files
-        elif is_in(['nitrate_plus_nitrite', 'silicate', 'phosphate'], channel) and not is_in(['flag'], channel):
-            try:
-                ncfile_var_list.append(OceanNcVar('nutrient', ctdcls.channels['Name'][i],
-                                                  ctdcls.channels['Units'][i], ctdcls.channels['Minimum'][i],
-                                                  ctdcls.channels['Maximum'][i], ctdcls.data[:, i], ncfile_var_list,
-                                                  ('z'), null_value))
-            except Exception as e:
-                print(e)
-        else:
+        # variable type and name of channel are looked up in CHANNEL_RULES (see channel_table.py)
+        rule = classify_channel(channel, 'ctd')
+        if rule is None:
             print(channel, ctdcls.channels['Units'][i], 'not transferred to netcdf file !')
             # raise Exception('not found !!')
+            continue
+        try:
+            ncfile_var_list.append(OceanNcVar(rule.vartype, rule.name or ctdcls.channels['Name'][i],
+                                              ctdcls.channels['Units'][i], ctdcls.channels['Minimum'][i],
+                                              ctdcls.channels['Maximum'][i], ctdcls.get_column(i), ncfile_var_list,
+                                              ('z'), null_value))
+        except Exception as e:
+            # nutrients in bottle files with units that do not have a BODC code are not transferred
+            if rule.vartype != 'nutrient':
+                raise
+            print(e)
 
-    # attach variables to ncfileclass and call method to write netcdf file
+    # attach variables to ncfileclass
     out.varlist = ncfile_var_list
-    out.write_ncfile(filename)
-    print("Finished writing file:", filename, "\n")
-    # release_memory(out)
-    return 1
+    return out
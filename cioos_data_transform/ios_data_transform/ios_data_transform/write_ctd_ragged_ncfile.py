@@ -0,0 +1,120 @@
+import copy
+import numpy as np
+from .OceanNcFile import CtdRaggedNcFile
+from .OceanNcVar import OceanNcVar
+from .write_ctd_ncfile import build_ctd_ncfile
+
+
+def write_ctd_ragged_ncfile(filename, ctdcls_list, profile='fast', header_format='attribute'):
+    '''
+    write many CTD (or bottle) profiles into one netcdf file (CF featureType=profile, contiguous ragged array)
+    each profile is set up using build_ctd_ncfile (same variables as write_ctd_ncfile). scalar variables
+    are written along dimension 'profile' and data variables are appended along dimension 'obs'.
+    rowSize has the number of observations in each profile
+    inputs:
+        filename: output file name to be created in netcdf format
+        ctdcls_list: list of ctd objects (CtdFile or BotFile) with data imported
+        profile: netcdf write profile ('fast', 'balanced' or 'archive'). sets compression and chunking
+        header_format: encoding of the header of each profile in variable header (see OceanNcFile.HEADER_FORMATS)
+    output:
+        number of profiles written to the file
+    '''
+    profiles = []
+    for ctdcls in ctdcls_list:
+        try:
+            ncfile = build_ctd_ncfile(ctdcls, profile, header_format)
+        except Exception as e:
+            print("Error: Unable to add profile to aggregated file:", ctdcls.filename, e)
+            continue
+        if not all([len(var.data) == ncfile.nrec for var in ncfile.varlist if len(get_dims(var)) > 0]):
+            print("Error: Number of records does not match data. Profile not added:", ctdcls.filename)
+            continue
+        profiles.append(ncfile)
+    if len(profiles) == 0:
+        raise Exception('No profiles to write into file: {}'.format(filename))
+
+    out = CtdRaggedNcFile()
+    out.profile = profile
+    out.header_format = header_format
+    # global attributes are taken from the first profile
+    for key in ['featureType', 'summary', 'title', 'institution', 'infoUrl']:
+        setattr(out, key, getattr(profiles[0], key))
+    out.nprof = len(profiles)
+    out.nrec = sum([p.nrec for p in profiles])
+
+    # collect variables of all profiles. variables are added in order of first appearance
+    names = []
+    template = {}
+    values = {}
+    for i, p in enumerate(profiles):
+        for var in p.varlist:
+            if var.name not in template:
+                names.append(var.name)
+                template[var.name] = var
+                values[var.name] = [None] * len(profiles)
+            values[var.name][i] = var.data
+
+    ncfile_var_list = [OceanNcVar('row_size', 'rowSize', None, None, None, [p.nrec for p in profiles],
+                                  vardim=('profile',))]
+    # full original header of each profile, as json dictionary (encoded as set by header_format)
+    ncfile_var_list.append(OceanNcVar('str_id', 'header', None, None, None, [p.HEADER for p in profiles],
+                                      vardim=('profile',)))
+    for name in names:
+        var = template[name]
+        if len(get_dims(var)) == 0:
+            ncfile_var_list.append(ragged_var(var, name, profile_values(var, values[name]), ('profile',)))
+        else:
+            ncfile_var_list.append(ragged_var(var, name, obs_values(values[name], profiles), ('obs',)))
+
+    out.varlist = ncfile_var_list
+    out.write_ncfile(filename)
+    print("Finished writing file:", filename, "\n")
+    return len(profiles)
+
+
+def group_ctd_files(ctdcls_list, by='cruise'):
+    # group ctd objects for aggregation
+    # by='cruise' uses MISSION (or CRUISE) in ADMINISTRATION and by='year' uses year of start time
+    # returns dictionary with list of ctd objects for each cruise/year
+    groups = {}
+    for ctdcls in ctdcls_list:
+        if by == 'cruise':
+            if 'MISSION' in ctdcls.administration:
+                key = ctdcls.administration['MISSION'].strip()
+            else:
+                key = ctdcls.administration['CRUISE'].strip()
+        elif by == 'year':
+            key = ctdcls.start_date[0:4]
+        else:
+            raise Exception('Unknown grouping for aggregation: {}'.format(by))
+        groups.setdefault(key, []).append(ctdcls)
+    return groups
+
+
+def get_dims(var):
+    # dimensions of var as tuple. ('z') is a string and not a tuple
+    if isinstance(var.dimensions, str):
+        return (var.dimensions,)
+    return var.dimensions
+
+
+def ragged_var(var, name, data, dims):
+    # copy of var (with all attributes set by OceanNcVar) with data and dimensions of the aggregated file
+    buf = copy.copy(var)
+    buf.name = name
+    buf.data = data
+    buf.dimensions = dims
+    return buf
+
+
+def profile_values(var, values):
+    # value of scalar variable for each profile. missing values are empty strings or NaN
+    if var.datatype == str:
+        return ['' if v is None else v for v in values]
+    return [float('nan') if v is None else np.ravel(v)[0] for v in values]
+
+
+def obs_values(values, profiles):
+    # data of all profiles appended along dimension 'obs'. profiles without the variable are filled with NaN
+    return np.concatenate([np.full(p.nrec, float('nan')) if v is None else np.asarray(v, dtype=float)
+                           for v, p in zip(values, profiles)])
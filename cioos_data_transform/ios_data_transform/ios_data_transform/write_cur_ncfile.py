@@ -0,0 +1,152 @@
+import numpy as np
+from .OceanNcFile import CurNcFile
+from .OceanNcVar import OceanNcVar
+from .channel_table import classify_channel, NcVarList
+from .utils import column_source
+
+
+def write_cur_ncfile(filename, curcls, profile='fast', chunk_size=100000, header_format='attribute'):
+    '''
+    use data and methods in curcls object to write the current meter data into a netcdf file
+    data block is read and written in chunks of chunk_size records (see ObsFile.iter_data)
+    so that long records are converted without holding all the data in memory
+    inputs:
+        filename: output file name to be created in netcdf format
+        curcls: current meter object (CurFile). includes methods to read IOS format
+        profile: netcdf write profile ('fast', 'balanced' or 'archive'). sets compression and chunking
+        chunk_size: number of records read and written at a time
+        header_format: encoding of the original header (see OceanNcFile.HEADER_FORMATS)
+    output:
+        NONE
+    '''
+    out = CurNcFile()
+    out.profile = profile
+    # write global attributes
+    out.featureType = 'timeSeries'
+    out.summary = 'This dataset contains observations made by the Institute of Ocean Sciences of Fisheries and Oceans (DFO) using current meters mounted on moorings.'
+    out.title = 'This dataset contains observations made by the Institute of Ocean Sciences of Fisheries and Oceans (DFO) using current meters mounted on moorings.'
+    out.institution = 'Institute of Ocean Sciences, 9860 West Saanich Road, Sidney, B.C., Canada'
+    out.infoUrl = 'http://www.pac.dfo-mpo.gc.ca/science/oceans/data-donnees/index-eng.html'
+    # write full original header, as json dictionary
+    out.header_format = header_format
+    out.HEADER = curcls.get_header_json(compact=header_format != 'attribute')
+    # expected number of records. time dimension grows as chunks are written
+    out.nrec = int(curcls.file['NUMBER OF RECORDS'])
+    ncfile_var_list = NcVarList()
+    ncfile_var_list.append(OceanNcVar('str_id', 'filename', None, None, None, curcls.filename.split('/')[-1]))
+    # add administration variables
+    if 'COUNTRY' in curcls.administration:
+        ncfile_var_list.append(
+            OceanNcVar('str_id', 'country', None, None, None, curcls.administration['COUNTRY'].strip()))
+    if 'MISSION' in curcls.deployment:
+        mission_id = curcls.deployment['MISSION'].strip()
+    else:
+        mission_id = 'n/a'
+    if mission_id.lower() == 'n/a':
+        raise Exception("Error: Mission ID not available", curcls.filename)
+
+    buf = mission_id.split('-')
+    mission_id = '{:4d}-{:03d}'.format(int(buf[0]), int(buf[1]))
+    ncfile_var_list.append(OceanNcVar('str_id', 'deployment_mission_id', None, None, None, mission_id))
+    if 'SCIENTIST' in curcls.administration:
+        ncfile_var_list.append(
+            OceanNcVar('str_id', 'scientist', None, None, None, curcls.administration['SCIENTIST'].strip()))
+    if 'PROJECT' in curcls.administration:
+        ncfile_var_list.append(
+            OceanNcVar('str_id', 'project', None, None, None, curcls.administration['PROJECT'].strip()))
+    if 'AGENCY' in curcls.administration:
+        ncfile_var_list.append(
+            OceanNcVar('str_id', 'agency', None, None, None, curcls.administration['AGENCY'].strip()))
+    if 'PLATFORM' in curcls.administration:
+        ncfile_var_list.append(
+            OceanNcVar('str_id', 'platform', None, None, None, curcls.administration['PLATFORM'].strip()))
+    # add instrument type
+    if 'TYPE' in curcls.instrument:
+        ncfile_var_list.append(
+            OceanNcVar('str_id', 'instrument_type', None, None, None, curcls.instrument['TYPE'].strip()))
+    if 'MODEL' in curcls.instrument:
+        ncfile_var_list.append(
+            OceanNcVar('str_id', 'instrument_model', None, None, None, curcls.instrument['MODEL'].strip()))
+    if 'SERIAL NUMBER' in curcls.instrument:
+        ncfile_var_list.append(OceanNcVar('str_id', 'instrument_serial_number', None, None, None,
+                                          curcls.instrument['SERIAL NUMBER'].strip()))
+    if 'DEPTH' in curcls.instrument:
+        ncfile_var_list.append(
+            OceanNcVar('instr_depth', 'instrument_depth', None, None, None, float(curcls.instrument['DEPTH'])))
+    # add locations variables
+    ncfile_var_list.append(OceanNcVar('lat', 'latitude', 'degrees_north', None, None, curcls.location['LATITUDE']))
+    ncfile_var_list.append(OceanNcVar('lon', 'longitude', 'degrees_east', None, None, curcls.location['LONGITUDE']))
+    ncfile_var_list.append(OceanNcVar('str_id', 'geographic_area', None, None, None, curcls.geo_code))
+
+    if 'EVENT NUMBER' in curcls.location:
+        event_id = curcls.location['EVENT NUMBER'].strip()
+    else:
+        print("Event number not found!" + curcls.filename)
+        event_id = '0000'
+    ncfile_var_list.append(OceanNcVar('str_id', 'event_number', None, None, None, event_id))
+    profile_id = '{:04d}-{:03d}-{:04d}'.format(int(buf[0]), int(buf[1]), int(event_id))
+    ncfile_var_list.append(OceanNcVar('profile', 'profile', None, None, None, profile_id))
+    # add time variable. time of each record is read from the date and time channels of each chunk
+    # (computed from start time and time increment if the file has no date channel)
+    var = OceanNcVar('time', 'time', None, None, None, np.empty(0, dtype='datetime64[us]'), vardim=('time',))
+    var.source = lambda start, block: curcls.get_record_time(block, start)
+    ncfile_var_list.append(var)
+    # go through channels and add each variable depending on type
+    # variables are created without data. data for each chunk is read from the column of the channel
+    speed, direction = None, None
+    for i, channel in enumerate(curcls.channels['Name']):
+        try:
+            null_value = curcls.channel_details['Pad'][i]
+        except Exception as e:
+            if 'PAD' in curcls.file.keys():
+                null_value = curcls.file['PAD'].strip()
+                print("Channel Details missing. Setting Pad value to: ", null_value.strip())
+            else:
+                print("Channel Details missing. Setting Pad value to ' ' ...")
+                null_value = "' '"
+        # variable type of channel is looked up in CHANNEL_RULES (see channel_table.py)
+        rule = classify_channel(channel, 'cur')
+        if rule is None:
+            print(channel, 'not transferred to netcdf file !')
+            continue
+        vartype = rule.vartype
+        var = OceanNcVar(vartype, curcls.channels['Name'][i], curcls.channels['Units'][i],
+                         curcls.channels['Minimum'][i], curcls.channels['Maximum'][i], np.empty(0),
+                         ncfile_var_list, ('time',), null_value)
+        var.source = column_source(curcls, i)
+        ncfile_var_list.append(var)
+        if vartype == 'speed' and speed is None:
+            speed = var
+        elif vartype == 'direction' and direction is None:
+            direction = var
+    # add velocity components derived from speed and direction (direction the current is flowing to)
+    if speed is not None and direction is not None:
+        sources = velocity_sources(speed, direction)
+        for component in ['u', 'v']:
+            var = OceanNcVar(component, component, speed.units, None, None, np.empty(0), ncfile_var_list, ('time',))
+            var.source = sources[component]
+            ncfile_var_list.append(var)
+
+    # attach variables and data chunks to ncfileclass and call method to write netcdf file
+    # data already read by import_data (not lazy) is written in slices and not read again (see iter_data)
+    out.varlist = ncfile_var_list
+    out.chunks = curcls.iter_data(chunk_size, masked=True)
+    out.write_ncfile(filename)
+    print("Finished writing file:", filename, "\n")
+    return 1
+
+
+def velocity_sources(speed, direction):
+    # data sources for eastward (u) and northward (v) velocity computed from speed and direction variables
+    # both components are computed once for each chunk (start) and shared by the two sources
+    # pad values in speed or direction are NaN in the velocity components
+    last = {}
+
+    def components(start, block):
+        if last.get('start') != start:
+            angle = np.deg2rad(direction.get_chunk(start, block))
+            values = speed.get_chunk(start, block)
+            last.update(start=start, u=values * np.sin(angle), v=values * np.cos(angle))
+        return last
+
+    return {component: (lambda start, block, c=component: components(start, block)[c]) for component in ['u', 'v']}
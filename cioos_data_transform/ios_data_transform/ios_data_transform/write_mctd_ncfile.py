@@ -1,21 +1,27 @@
-import json
 from .OceanNcFile import MCtdNcFile
 from .OceanNcVar import OceanNcVar
-from .utils import is_in, release_memory, find_geographic_area, read_geojson
-from shapely.geometry import Point
+from .channel_table import classify_channel, NcVarList
+from .utils import column_source
+import numpy as np
 
 
-def write_mctd_ncfile(filename, ctdcls):
+def write_mctd_ncfile(filename, ctdcls, profile='fast', chunk_size=100000, header_format='attribute'):
     '''
     use data and methods in ctdcls object to write the CTD data into a netcdf file
+    data block is read and written in chunks of chunk_size records along the unlimited time dimension
+    (see ObsFile.iter_data) so that memory used does not depend on the length of the record
     author: Pramod Thupaki pramod.thupaki@hakai.org
     inputs:
         filename: output file name to be created in netcdf format
         ctdcls: ctd object. includes methods to read IOS format and stores data
+        profile: netcdf write profile ('fast', 'balanced' or 'archive'). sets compression and chunking
+        chunk_size: number of records read and written at a time
+        header_format: encoding of the original header (see OceanNcFile.HEADER_FORMATS)
     output:
         NONE
     '''
     out = MCtdNcFile()
+    out.profile = profile
     # write global attributes
     out.featureType = 'timeSeries'
     out.summary = 'This dataset contains observations made by the Institute of Ocean Sciences of Fisheries and Oceans (DFO) using CTDs mounted on moorings.'
@@ -24,11 +30,12 @@ def write_mctd_ncfile(filename, ctdcls):
     out.infoUrl = 'http://www.pac.dfo-mpo.gc.ca/science/oceans/data-donnees/index-eng.html'
     out.cdm_profile_variables = 'time'  # TEMPS901, TEMPS902, TEMPS601, TEMPS602, TEMPS01, PSALST01, PSALST02, PSALSTPPT01, PRESPR01
     # write full original header, as json dictionary
-    out.HEADER = json.dumps(ctdcls.get_complete_header(), ensure_ascii=False, indent=False)
-    # initcreate dimension variable
+    out.header_format = header_format
+    out.HEADER = ctdcls.get_header_json(compact=header_format != 'attribute')
+    # expected number of records. time dimension grows as chunks are written
     out.nrec = int(ctdcls.file['NUMBER OF RECORDS'])
     # add variable profile_id (dummy variable)
-    ncfile_var_list = []
+    ncfile_var_list = NcVarList()
     # profile_id = random.randint(1, 100000)
     ncfile_var_list.append(OceanNcVar('str_id', 'filename', None, None, None, ctdcls.filename.split('/')[-1]))
     # add administration variables
@@ -85,8 +92,13 @@ def write_mctd_ncfile(filename, ctdcls):
     profile_id = '{:04d}-{:03d}-{:04d}'.format(int(buf[0]), int(buf[1]), int(event_id))
     # print(profile_id)
     ncfile_var_list.append(OceanNcVar('profile', 'profile', None, None, None, profile_id))
-    ncfile_var_list.append(OceanNcVar('time', 'time', None, None, None, ctdcls.obs_time, vardim=('time')))
+    # time of each record is read from the Date and Time channels of each chunk
+    # (computed from start time and time increment if the file has no date channel)
+    var = OceanNcVar('time', 'time', None, None, None, np.empty(0, dtype='datetime64[us]'), vardim=('time',))
+    var.source = lambda start, block: ctdcls.get_record_time(block, start)
+    ncfile_var_list.append(var)
     # go through channels and add each variable depending on type
+    # variables are created without data. data for each chunk is read from the column of the channel
     for i, channel in enumerate(ctdcls.channels['Name']):
         try:
             null_value = ctdcls.channel_details['Pad'][i]
@@ -97,42 +109,21 @@ def write_mctd_ncfile(filename, ctdcls):
             else:
                 print("Channel Details missing. Setting Pad value to ' ' ...")
                 null_value = "' '"
-        if is_in(['depth'], channel):
-            ncfile_var_list.append(OceanNcVar('depth', 'depth',
-                                              ctdcls.channels['Units'][i], ctdcls.channels['Minimum'][i],
-                                              ctdcls.channels['Maximum'][i], ctdcls.data[:, i], ncfile_var_list,
-                                              ('time'), null_value))
-        elif is_in(['pressure'], channel):
-            ncfile_var_list.append(OceanNcVar('pressure', 'pressure',
-                                              ctdcls.channels['Units'][i], ctdcls.channels['Minimum'][i],
-                                              ctdcls.channels['Maximum'][i], ctdcls.data[:, i], ncfile_var_list,
-                                              ('time'), null_value))
-        elif is_in(['temperature'], channel) and not is_in(['flag', 'bottle'], channel):
-            ncfile_var_list.append(OceanNcVar('temperature', ctdcls.channels['Name'][i],
-                                              ctdcls.channels['Units'][i], ctdcls.channels['Minimum'][i],
-                                              ctdcls.channels['Maximum'][i], ctdcls.data[:, i], ncfile_var_list,
-                                              ('time'), null_value))
-        elif is_in(['salinity'], channel) and not is_in(['flag', 'bottle'], channel):
-            ncfile_var_list.append(OceanNcVar('salinity', ctdcls.channels['Name'][i],
-                                              ctdcls.channels['Units'][i], ctdcls.channels['Minimum'][i],
-                                              ctdcls.channels['Maximum'][i], ctdcls.data[:, i], ncfile_var_list,
-                                              ('time'), null_value))
-        elif is_in(['oxygen'], channel) and not is_in(['flag', 'bottle', 'rinko', 'temperature', 'current'], channel):
-            ncfile_var_list.append(OceanNcVar('oxygen', ctdcls.channels['Name'][i],
-                                              ctdcls.channels['Units'][i], ctdcls.channels['Minimum'][i],
-                                              ctdcls.channels['Maximum'][i], ctdcls.data[:, i], ncfile_var_list,
-                                              ('time'), null_value))
-        elif is_in(['conductivity'], channel):
-            ncfile_var_list.append(OceanNcVar('conductivity', ctdcls.channels['Name'][i],
-                                              ctdcls.channels['Units'][i], ctdcls.channels['Minimum'][i],
-                                              ctdcls.channels['Maximum'][i], ctdcls.data[:, i], ncfile_var_list,
-                                              ('time'), null_value))
-        else:
+        # variable type and name of channel are looked up in CHANNEL_RULES (see channel_table.py)
+        rule = classify_channel(channel, 'mctd')
+        if rule is None:
             print(channel, 'not transferred to netcdf file !')
             # raise Exception('not found !!')
+            continue
+        vartype, varname = rule.vartype, rule.name or ctdcls.channels['Name'][i]
+        var = OceanNcVar(vartype, varname, ctdcls.channels['Units'][i], ctdcls.channels['Minimum'][i],
+                         ctdcls.channels['Maximum'][i], np.empty(0), ncfile_var_list, ('time',), null_value)
+        var.source = column_source(ctdcls, i)
+        ncfile_var_list.append(var)
 
-    # attach variables to ncfileclass and call method to write netcdf file
+    # attach variables and data chunks to ncfileclass and call method to write netcdf file
     out.varlist = ncfile_var_list
+    out.chunks = ctdcls.iter_data(chunk_size, masked=True)
     out.write_ncfile(filename)
     print("Finished writing file:", filename, "\n")
     # release_memory(out)
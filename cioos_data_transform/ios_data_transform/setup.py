@@ -13,7 +13,7 @@ setuptools.setup(
     long_description_content_type="text/markdown",
     url="https://github.com/cioos-siooc/cioos-siooc_data_transform",
     packages=setuptools.find_packages(),
-    install_requires=['numpy', 'fortranformat', 'netCDF4', 'pytz', 'shapely', 'gsw'],
+    install_requires=['numpy', 'fortranformat', 'netCDF4', 'pytz', 'shapely>=2.0', 'gsw'],
     classifiers=["Programming Language :: Python :: 3",
         "Operating System :: OS Independent"],
 )